@@ -0,0 +1,56 @@
+"""
+Benchmark the construction of class environments as the number of versions
+of a class grows.
+
+Usage: python -m benchmarks.bench_lookup [N ...]
+"""
+
+import ast
+import sys
+import time
+
+from vpy.lib.utils import get_class_environment
+
+
+def versioned_class(n: int) -> ast.ClassDef:
+    """
+    Returns the AST of a class with `n` versions, where each version replaces
+    the previous one, renames its field and defines lenses in both directions.
+    """
+    lines = [f'@version(name="v0")']
+    lines += [f'@version(name="v{i}", replaces=["v{i - 1}"])' for i in range(1, n)]
+    lines += ["class C:"]
+    for i in range(n):
+        lines += [
+            f'    @at("v{i}")',
+            f"    def __init__(self, x: int):",
+            f"        self.f{i} = x",
+            f'    @at("v{i}")',
+            f"    def get(self) -> int:",
+            f"        return self.f{i}",
+        ]
+        if i > 0:
+            lines += [
+                f'    @get("v{i}", "v{i - 1}", "f{i - 1}")',
+                f"    def lens_{i}_{i - 1}(self) -> int:",
+                f"        return self.f{i}",
+                f'    @get("v{i - 1}", "v{i}", "f{i}")',
+                f"    def lens_{i - 1}_{i}(self) -> int:",
+                f"        return self.f{i - 1}",
+            ]
+    cls_ast = ast.parse("\n".join(lines)).body[0]
+    assert isinstance(cls_ast, ast.ClassDef)
+    return cls_ast
+
+
+def bench(n: int) -> float:
+    cls_ast = versioned_class(n)
+    start = time.perf_counter()
+    get_class_environment(cls_ast)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [2, 4, 8, 16, 32]
+    for n in sizes:
+        print(f"{n:>4} versions: {bench(n):.4f}s")
@@ -0,0 +1,143 @@
+"""
+Benchmark the rewrite of a method to another version as the number of
+statements of the method grows, and the collection of aliases and extraction
+of fields to local variables in a single traversal of the method against two
+traversals, one per pass.
+
+Usage: python -m benchmarks.bench_rewrite [N ...]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from ast import ClassDef, FunctionDef
+
+from vpy.lib.lib_types import VersionId
+from vpy.lib.slice import SliceSession
+from vpy.lib.transformers.rewrite import ExtractLocalVar
+from vpy.lib.utils import (
+    deepcopy_node,
+    get_at,
+    get_module_environment,
+    graph,
+    parse_module,
+    used_names,
+)
+from vpy.lib.visitors.alias import AliasVisitor
+
+
+def versioned_module(n: int) -> str:
+    """
+    Returns the code of a module with a class whose field `x` of version 1 is
+    renamed to `y` in version 2, with a method of version 2 made of `n` blocks
+    of statements that read, write and alias the field.
+    """
+    lines = [
+        "from vpy.decorators import at, get, version",
+        "",
+        '@version(name="1")',
+        '@version(name="2", replaces=["1"])',
+        "class C:",
+        '    @at("1")',
+        "    def __init__(self):",
+        "        self.x = 1",
+        '    @at("2")',
+        "    def __init__(self):",
+        "        self.y = 1",
+        '    @at("2")',
+        "    def m(self) -> int:",
+        "        a = 0",
+    ]
+    for i in range(n):
+        lines += [
+            f"        a = a + self.y * {i}",
+            f"        self.y = a - {i}",
+            f"        if self.y > {i}:",
+            "            self.y += 1",
+            f"        b = self.y",
+            f"        print(b, self.y)",
+        ]
+    lines += [
+        "        return self.y",
+        '    @get("2", "1", "x")',
+        "    def lens_x(self) -> int:",
+        "        return self.y",
+        '    @get("1", "2", "y")',
+        "    def lens_y(self) -> int:",
+        "        return self.x",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def bench(n: int, repeat: int = 5) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"bench_rewrite_{n}.py")
+        with open(path, "w") as f:
+            f.write(versioned_module(n))
+        with contextlib.redirect_stderr(io.StringIO()):
+            session = SliceSession(path)
+        session.slice(VersionId("1"))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            session.slice(VersionId("1"))
+        return (time.perf_counter() - start) / repeat
+
+
+def bench_extract(n: int, repeat: int = 5) -> tuple[float, float]:
+    """
+    Returns the time to collect the aliases of method `m` and extract its
+    fields to local variables for version 1, in two traversals and in one.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"bench_rewrite_{n}.py")
+        with open(path, "w") as f:
+            f.write(versioned_module(n))
+        with contextlib.redirect_stderr(io.StringIO()):
+            tree, _ = parse_module(path)
+    env = get_module_environment(tree)
+    cls_ast = next(node for node in tree.body if isinstance(node, ClassDef))
+    method = next(
+        node
+        for node in cls_ast.body
+        if isinstance(node, FunctionDef) and node.name == "m"
+    )
+    g = graph(cls_ast)
+    v_from = get_at(method)
+
+    def extract(node: FunctionDef, fused: bool):
+        alias_visitor = AliasVisitor(g=g, cls_ast=cls_ast, env=env, v_from=v_from)
+        visitor = ExtractLocalVar(
+            g=g,
+            cls_ast=cls_ast,
+            env=env,
+            v_from=v_from,
+            v_target=VersionId("1"),
+            aliases=alias_visitor.aliases,
+            names=used_names(node),
+            collect_aliases=alias_visitor.visit if fused else None,
+        )
+        if not fused:
+            alias_visitor.visit(node)
+        visitor.visit(node)
+
+    times = []
+    for fused in (False, True):
+        nodes = [deepcopy_node(method) for _ in range(repeat)]
+        start = time.perf_counter()
+        for node in nodes:
+            extract(node, fused)
+        times.append((time.perf_counter() - start) / repeat)
+    return times[0], times[1]
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [8, 16, 32, 64]
+    for n in sizes:
+        two, one = bench_extract(n)
+        print(
+            f"{n:>4} blocks: {bench(n):.4f}s"
+            f" (aliases and locals: {two:.4f}s in two passes, {one:.4f}s in one)"
+        )
@@ -0,0 +1,49 @@
+"""
+Benchmark slicing an analyzed module for a single version as the number of
+versions of its class grows, against building the environment of the whole
+class, which looks up the lenses between every pair of versions.
+
+Usage: python -m benchmarks.bench_slice [N ...]
+"""
+
+import ast
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_lookup import versioned_class
+from vpy.lib.lib_types import VersionId
+from vpy.lib.slice import SliceSession
+from vpy.lib.utils import get_class_environment, parse_module
+
+
+def bench(n: int) -> tuple[float, float]:
+    code = "from vpy.decorators import at, get, version\n\n\n"
+    # The methods named `get` would shadow the decorator when importing it.
+    code += ast.unparse(versioned_class(n)).replace("def get(", "def value(")
+    code += "\n"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"bench_slice_{n}.py")
+        with open(path, "w") as f:
+            f.write(code)
+        with contextlib.redirect_stderr(io.StringIO()):
+            tree, _ = parse_module(path, check_lenses=False)
+        session = SliceSession(tree=tree)
+        start = time.perf_counter()
+        session.slice(VersionId(f"v{n - 1}"))
+        sliced = time.perf_counter() - start
+        cls_ast = session.tree.body[-1]
+        assert isinstance(cls_ast, ast.ClassDef)
+        start = time.perf_counter()
+        get_class_environment(cls_ast)
+        return sliced, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [8, 16, 32, 64]
+    for n in sizes:
+        sliced, build = bench(n)
+        print(f"{n:>4} versions: slice {sliced:.4f}s, environment {build:.4f}s")
@@ -0,0 +1,69 @@
+"""
+Benchmark the analysis of a module after the body of one method of its class
+is edited, updating the lookups of the previous analysis against looking up
+everything again, as the number of versions of the class grows.
+
+Usage: python -m benchmarks.bench_update [N ...]
+"""
+
+import ast
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_lookup import versioned_class
+from vpy.lib.utils import get_module_environment, parse_module
+
+
+def versioned_module(n: int, edited: bool = False) -> str:
+    """
+    Returns the code of a module with the class of `versioned_class(n)`. If
+    `edited`, the body of the method `get` of its first version is edited.
+    """
+    cls_ast = versioned_class(n)
+    if edited:
+        get = cls_ast.body[1]
+        assert isinstance(get, ast.FunctionDef)
+        get.body = ast.parse("return self.f0 + 1").body
+    return "from vpy.decorators import at, get, version\n\n\n" + ast.unparse(cls_ast)
+
+
+def analyze(path: str, code: str, previous: ast.Module | None = None):
+    with open(path, "w") as f:
+        f.write(code)
+    with contextlib.redirect_stderr(io.StringIO()):
+        tree, _ = parse_module(path, previous=previous)
+    get_module_environment(tree)
+    return tree
+
+
+def bench(n: int) -> tuple[float, float, float]:
+    """
+    Returns the time to analyze the module of `n` versions, and to analyze it
+    again after the edit with and without the previous analysis.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        # Each analysis imports a module of its own.
+        paths = [os.path.join(tmp, f"bench_update_{n}_{i}.py") for i in range(3)]
+        start = time.perf_counter()
+        old = analyze(paths[0], versioned_module(n))
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        analyze(paths[1], versioned_module(n, edited=True), previous=old)
+        update = time.perf_counter() - start
+        start = time.perf_counter()
+        analyze(paths[2], versioned_module(n, edited=True))
+        return first, update, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [8, 16, 32, 64]
+    for n in sizes:
+        first, update, again = bench(n)
+        print(
+            f"{n:>4} versions: analysis {first:.4f}s, after the edit "
+            f"{update:.4f}s updated, {again:.4f}s from scratch"
+        )
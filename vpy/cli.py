@@ -1,71 +1,346 @@
 import argparse
+import glob
+import io
 import json
 import logging
 import os
 import ast
-import importlib.util
-from vpy.lib.lib_types import VersionId
-from vpy.lib.transformers.module import ModuleStrictTransformer, ModuleTransformer
-from vpy.lib.transformers.toolkit import AddVersionTransformer
-from vpy.lib.utils import parse_module, graph
-
-
-# TODO: Refactor this code, read errors from namecheckvisitor
-def graph_versions(file: str) -> dict[str, list]:
-    spec = importlib.util.spec_from_file_location(file[:-3], file)
-    if spec is None or spec.loader is None:
-        exit("Error reading module.")
-    with open(file) as f:
-        module_ast = ast.parse("\n".join(f.readlines()))
-    versions: dict[str, list] = {}
-    for node in module_ast.body:
-        if isinstance(node, ast.ClassDef):
-            versions[node.name] = graph(node).tree()
-    return versions
-
-
-def list_versions(file: str) -> set[VersionId]:
-    spec = importlib.util.spec_from_file_location(file[:-3], file)
-    if spec is None or spec.loader is None:
-        exit("Error reading module.")
-    # module = importlib.util.module_from_spec(spec)
-    # spec.loader.exec_module(module)
-    with open(file) as f:
-        module_ast = ast.parse("\n".join(f.readlines()))
-    versions: set[VersionId] = set()
-    for node in module_ast.body:
-        if isinstance(node, ast.ClassDef):
-            versions = versions.union({v.name for v in graph(node).all()})
-    return versions
-
-
-def target(file: str, version: VersionId, strict: bool = False):
-    if version not in list_versions(file):
+import sys
+import time
+from contextlib import nullcontext, redirect_stderr
+from typing import TYPE_CHECKING, Any
+from vpy import daemon
+from vpy.lib import cache
+
+# The analysis modules are imported where they are used, so that client runs
+# (see vpy.daemon) do not pay for importing them.
+if TYPE_CHECKING:
+    from vpy.lib.lib_types import VersionId
+    from vpy.lib.slice import SliceSession
+
+
+class ModuleFile:
+    """
+    Module file given to the command line. Its source is read and parsed at
+    most once, and it is imported and analyzed at most once, when a command
+    needs an analysis that is not in the cache. If the module file analyzed
+    for previous contents of the file is given, the analysis updates its
+    lookups.
+    """
+
+    def __init__(self, file: str, previous: "ModuleFile | None" = None):
+        self.file = file
+        self.analysis = cache.load_analysis(file)
+        self.__source: str | None = None
+        self.__tree: ast.Module | None = None
+        self.__annotated = False
+        self.__session: "SliceSession | None" = None
+        self.__reported = False
+        self.__previous = (
+            previous.__tree if previous is not None and previous.__annotated else None
+        )
+
+    @property
+    def tree(self) -> ast.Module:
+        if self.__tree is None:
+            with open(self.file) as f:
+                self.__source = f.read()
+            self.__tree = ast.parse(self.__source, self.file)
+        return self.__tree
+
+    def save(self):
+        cache.store_analysis(self.file, self.analysis)
+
+    def versions(self) -> set["VersionId"]:
+        from vpy.lib.lib_types import VersionId, graph
+
+        if "versions" not in self.analysis:
+            versions: set[VersionId] = set()
+            for node in self.tree.body:
+                if isinstance(node, ast.ClassDef):
+                    versions = versions.union({v.name for v in graph(node).all()})
+            self.analysis["versions"] = sorted(versions)
+            self.save()
+        return {VersionId(v) for v in self.analysis["versions"]}
+
+    def graph(self) -> dict[str, list]:
+        from vpy.lib.lib_types import graph
+
+        if "graph" not in self.analysis:
+            versions: dict[str, list] = {}
+            for node in self.tree.body:
+                if isinstance(node, ast.ClassDef):
+                    versions[node.name] = graph(node).tree()
+            self.analysis["graph"] = versions
+            self.save()
+        return self.analysis["graph"]
+
+    def annotate(self) -> ast.Module:
+        """
+        Imports and analyzes the module, recording its failures, and returns
+        its annotated tree. If the failures are cached, the lenses of the
+        module are not checked again.
+        """
+        from vpy.lib.utils import parse_module
+
+        if not self.__annotated:
+            tree = self.tree
+            check = "failures" not in self.analysis
+            # Do not print the failures again if they were replayed already.
+            quiet = (
+                redirect_stderr(io.StringIO())
+                if self.__reported or not check
+                else nullcontext()
+            )
+            with quiet:
+                _, visitor = parse_module(
+                    self.file,
+                    code=self.__source,
+                    tree=tree,
+                    check_lenses=check,
+                    previous=self.__previous,
+                )
+            self.__annotated = True
+            self.__previous = None
+            if check:
+                self.analysis["failures"] = visitor.all_failures
+                self.__reported = True
+                self.save()
+        return self.tree
+
+    def session(self) -> "SliceSession":
+        """
+        Returns a session to slice the analyzed module for any version.
+        """
+        from vpy.lib.slice import SliceSession
+
+        if self.__session is None:
+            self.__session = SliceSession(self.file, tree=self.annotate())
+        return self.__session
+
+    def failures(self) -> list[dict[str, Any]]:
+        """
+        Returns the failures of the module, printing them as the type checker
+        would. The module is only analyzed if they are not cached.
+        """
+        if "failures" not in self.analysis:
+            self.annotate()
+        elif not self.__reported:
+            for failure in self.analysis["failures"]:
+                sys.stderr.write(failure["message"])
+            sys.stderr.flush()
+            self.__reported = True
+        return self.analysis["failures"]
+
+    def slices(self, strict: bool) -> dict[str, str]:
+        """
+        Returns the cached code of the versions of the module.
+        """
+        return self.analysis.setdefault("strict" if strict else "slices", {})
+
+    def rerun(self):
+        """
+        Prepares the module for another command in the same process, which
+        prints its failures again.
+        """
+        self.__reported = False
+
+
+# Module files kept analyzed between the commands run by the daemon (see
+# vpy.daemon), with the path of their cached analysis, which hashes their
+# contents and those of the local modules they import. None outside the daemon.
+warm_modules: dict[str, tuple[str, ModuleFile]] | None = None
+
+
+def module_file(file: str) -> ModuleFile:
+    """
+    Returns the module file `file`, which is the one analyzed by a previous
+    command of the daemon if neither it nor the local modules it imports have
+    changed since. The modules imported by the analysis of a changed module
+    are imported again, and the lookups of its previous analysis are updated.
+    """
+    if warm_modules is None or not cache.enabled:
+        return ModuleFile(file)
+    path = os.path.abspath(file)
+    key = cache.cache_path(file)
+    if path in warm_modules and warm_modules[path][0] == key:
+        mod = warm_modules[path][1]
+        mod.rerun()
+        return mod
+    stale = {path, *cache.imported_files(file)}
+    for name, module in list(sys.modules.items()):
+        module_path = getattr(module, "__file__", None)
+        if module_path is not None and os.path.abspath(module_path) in stale:
+            del sys.modules[name]
+    previous = warm_modules[path][1] if path in warm_modules else None
+    mod = ModuleFile(file, previous)
+    warm_modules[path] = (key, mod)
+    return mod
+
+
+def target(mod: ModuleFile, version: "VersionId", strict: bool = False):
+    if version not in mod.versions():
         exit(f"Invalid target {version}")
-    spec = importlib.util.spec_from_file_location(os.path.basename(file)[:-3], file)
-    if spec is None or spec.loader is None:
-        exit(f"Error reading module from file {file}")
-    mod_ast, visitor = parse_module(file)
-    if strict:
-        mod_ast = ModuleStrictTransformer(version).visit(mod_ast)
+    if mod.failures() != [] and not strict:
+        exit(1)
+    slices = mod.slices(strict)
+    if version not in slices:
+        _, slices[version], _ = slice_version(mod.session(), version, strict)
+        mod.save()
+    print(slices[version])
+
+
+def slice_version(
+    session: "SliceSession", version: "VersionId", strict: bool
+) -> tuple["VersionId", str, float]:
+    """
+    Slices the analyzed module of `session` for `version`.
+    """
+    start = time.perf_counter()
+    code = session.code(version, strict=strict)
+    return version, code, time.perf_counter() - start
+
+
+# Analyzed module and slicing mode, inherited by the slicing workers on fork.
+__analysis: tuple["SliceSession", bool] | None = None
+
+
+def __slice_version(version: "VersionId") -> tuple["VersionId", str, float]:
+    """
+    Slices the analyzed module for `version`.
+    """
+    assert __analysis is not None
+    session, strict = __analysis
+    return slice_version(session, version, strict)
+
+
+def target_all(
+    mod: ModuleFile,
+    versions: list["VersionId"] | None,
+    output: str,
+    strict: bool = False,
+    jobs: int | None = None,
+):
+    """
+    Writes the code of each version in `versions` (all versions of the module
+    if None) to `output`/<version>/<module file>. The module is analyzed once
+    and the slices are computed in a pool of forked workers. Slices found in
+    the cached analysis of the module are written as they are.
+    """
+    import multiprocessing
+
+    global __analysis
+    available = mod.versions()
+    if versions is None:
+        versions = sorted(available)
+    for version in versions:
+        if version not in available:
+            exit(f"Invalid target {version}")
+
+    def write(version: "VersionId", code: str, elapsed: float | None):
+        path = os.path.join(output, version, os.path.basename(mod.file))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(code + "\n")
+        if elapsed is None:
+            logging.info(f"Sliced version {version} from cache: {path}")
+        else:
+            logging.info(f"Sliced version {version} in {elapsed:.3f}s: {path}")
+
+    start = time.perf_counter()
+    if mod.failures() != [] and not strict:
+        exit(1)
+    slices = mod.slices(strict)
+    missing = [v for v in versions if v not in slices]
+    for version in versions:
+        if version not in missing:
+            write(version, slices[version], None)
+    if missing == []:
+        return
+    session = mod.session()
+    logging.info(f"Analyzed {mod.file} in {time.perf_counter() - start:.3f}s")
+    if jobs == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        for version in missing:
+            _, slices[version], elapsed = slice_version(session, version, strict)
+            write(version, slices[version], elapsed)
     else:
-        if visitor.all_failures != []:
-            exit(1)
-        mod_ast = ModuleTransformer(version).visit(mod_ast)
-    slices = [ast.unparse(ast.fix_missing_locations(mod_ast))]
-    print("\n".join(slices))
-
-
-def check(file: str):
-    spec = importlib.util.spec_from_file_location(os.path.basename(file)[:-3], file)
-    if spec is None or spec.loader is None:
-        exit(f"Error reading module from file {file}")
-    _, visitor = parse_module(file)
-    if visitor.all_failures != []:
+        __analysis = (session, strict)
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(processes=jobs) as pool:
+            for version, code, elapsed in pool.imap_unordered(__slice_version, missing):
+                slices[version] = code
+                write(version, code, elapsed)
+    mod.save()
+
+
+def check(mod: ModuleFile):
+    if mod.failures() != []:
         return 0
     return 1
 
 
+def input_files(inputs: list[str]) -> list[str]:
+    """
+    Returns the python files given in `inputs` as files, directories or glob
+    patterns.
+    """
+    files: list[str] = []
+    for entry in inputs:
+        for path in sorted(glob.glob(entry, recursive=True)) or [entry]:
+            if not os.path.isdir(path):
+                files.append(path)
+                continue
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith((".", "__")))
+                files += [
+                    os.path.join(root, n) for n in sorted(names) if n.endswith(".py")
+                ]
+    return list(dict.fromkeys(files))
+
+
+def check_all(mods: list[ModuleFile], jobs: int | None = None) -> int:
+    """
+    Checks every versioned module in `mods`, analyzing those that are not
+    cached in a pool of `jobs` worker processes, and reports the failures of
+    each one. Modules that cannot be read or parsed are reported as failed,
+    without stopping the others. Unlike `check`, the exit status is 1 if any
+    module failed and 0 otherwise, as expected from a CI step.
+    """
+    start = time.perf_counter()
+    versioned: list[ModuleFile] = []
+    unreadable = 0
+    for mod in mods:
+        try:
+            if mod.versions() != set():
+                versioned.append(mod)
+        except (SyntaxError, OSError) as e:
+            logging.error(f"{mod.file}: cannot be checked: {e}")
+            unreadable += 1
+    mods = versioned
+    pending = [mod.file for mod in mods if "failures" not in mod.analysis]
+    checked: dict[str, list] = {}
+    if pending != []:
+        from vpy.typechecker.pyanalyze.version_checker import LensCheckVisitor
+
+        checked = LensCheckVisitor.check_modules(pending, jobs=jobs)
+    failed = total = unreadable
+    for mod in mods:
+        if mod.file in checked:
+            mod.analysis["failures"] = checked[mod.file]
+            mod.save()
+        failures = mod.failures()
+        logging.info(f"{mod.file}: {len(failures)} failures")
+        failed += failures != []
+        total += len(failures)
+    logging.info(
+        f"Checked {len(mods)} versioned modules ({len(pending)} analyzed) in "
+        f"{time.perf_counter() - start:.3f}s: {total} failures in {failed} modules"
+    )
+    if failed != 0:
+        return 1
+    return 0
+
+
 def argparser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -77,9 +352,34 @@ def argparser() -> argparse.ArgumentParser:
         help="Print JSON-formatted version graph of a module",
         action="store_true",
     )
-    parser.add_argument("-i", "--input", help="Input file name", required=True)
     parser.add_argument(
-        "-t", "--target", help="Extract code for a target version", required=False
+        "-i",
+        "--input",
+        help="Input file name (or files, directories and glob patterns to check, "
+        "exiting with status 1 if any of them fails)",
+        nargs="+",
+        required=False,
+    )
+    parser.add_argument(
+        "-t",
+        "--target",
+        help="Extract code for a target version (several versions with -o)",
+        nargs="+",
+        required=False,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the code of every version (or of each target) to a directory",
+        required=False,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes used to build the class environments, to "
+        "slice versions with -o or to check several modules",
+        type=int,
+        required=False,
     )
     parser.add_argument(
         "-s",
@@ -87,26 +387,81 @@ def argparser() -> argparse.ArgumentParser:
         help="Get explicit code of a version",
         action="store_true",
     )
+    parser.add_argument(
+        "--serve",
+        help=f"Serve vpy requests on a Unix socket (default: ${daemon.SOCKET_ENV} or "
+        f"{daemon.default_socket()}). Set ${daemon.SOCKET_ENV} to run vpy as its client. "
+        "The daemon keeps the analyses of the modules it is asked about until they "
+        "change",
+        nargs="?",
+        const=daemon.default_socket(),
+        metavar="SOCKET",
+    )
+    parser.add_argument(
+        "--no-cache",
+        help=f"Neither read nor write the analysis cache ({cache.CACHE_DIR})",
+        action="store_true",
+    )
     return parser
 
 
 def cli_main():
     args = argparser().parse_args()
-    logging.basicConfig(level=logging.INFO)
 
-    if not os.path.isfile(args.input):
+    if args.serve:
+        os.environ.pop(daemon.SOCKET_ENV, None)
+        daemon.serve(args.serve)
+        exit()
+
+    if os.environ.get(daemon.SOCKET_ENV):
+        status = daemon.request(os.environ[daemon.SOCKET_ENV], sys.argv[1:])
+        if status is not None:
+            exit(status)
+
+    from vpy.lib.lib_types import VersionId
+
+    # Log to the current stderr, which the daemon redirects for each command.
+    logging.basicConfig(level=logging.INFO, force=True)
+
+    if args.input is None:
+        exit("Missing input file.")
+
+    cache.enabled = not args.no_cache
+    # Listing the versions or graphs of a module reads the cache but does not
+    # create it.
+    cache.writable = not (args.list or args.graph)
+
+    files = [f for f in input_files(args.input) if os.path.isfile(f)]
+    if files == []:
         exit("Missing input file.")
+    if len(files) > 1:
+        if args.list or args.graph or args.target or args.output:
+            exit("Several input files can only be checked.")
+        exit(check_all([module_file(f) for f in files], jobs=args.jobs))
+
+    mod = module_file(files[0])
+    if not (args.list or args.graph):
+        from vpy.lib import utils
+
+        utils.environment_jobs = 1 if args.jobs is None else args.jobs
 
     if args.list:
-        print("\n".join(list_versions(args.input)))
+        print("\n".join(mod.versions()))
         exit()
 
     elif args.graph:
-        print(json.dumps(graph_versions(args.input)))
+        print(json.dumps(mod.graph()))
+        exit()
+
+    if args.output:
+        versions = [VersionId(v) for v in args.target] if args.target else None
+        target_all(mod, versions, args.output, strict=args.strict, jobs=args.jobs)
         exit()
 
     if args.target:
-        target(args.input, VersionId(args.target), strict=args.strict)
+        if len(args.target) > 1:
+            exit("Multiple targets require an output directory.")
+        target(mod, VersionId(args.target[0]), strict=args.strict)
         exit()
 
-    exit(check(args.input))
+    exit(check(mod))
@@ -0,0 +1,117 @@
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Any
+
+# Environment variable holding the socket of a running daemon. When it is set,
+# `vpy` runs as a client of that daemon. The daemon runs the requests one at a
+# time in its own process, keeping the type checker and the analyses of the
+# modules it was asked about until they change (see `vpy.cli.module_file`).
+SOCKET_ENV = "VPY_SOCKET"
+
+
+def default_socket() -> str:
+    """
+    Returns the path of the daemon socket.
+    """
+    return os.environ.get(SOCKET_ENV) or os.path.join(
+        tempfile.gettempdir(), f"vpy-{os.getuid()}.sock"
+    )
+
+
+def run(argv: list[str], cwd: str) -> dict[str, Any]:
+    """
+    Runs the command line `argv` in directory `cwd`, returning its output and
+    exit status. The working directory and arguments of the process are
+    restored afterwards.
+    """
+    from vpy.cli import cli_main
+
+    old_cwd, old_argv = os.getcwd(), sys.argv
+    stdout, stderr = io.StringIO(), io.StringIO()
+    status: Any = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(cwd)
+            sys.argv = ["vpy", *argv]
+            cli_main()
+        except SystemExit as e:
+            status = e.code
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.argv = old_argv
+            os.chdir(old_cwd)
+    if status is None:
+        status = 0
+    elif not isinstance(status, int):
+        stderr.write(f"{status}\n")
+        status = 1
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "status": status}
+
+
+class __Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        response = run(request["argv"], request["cwd"])
+        self.wfile.write(json.dumps(response).encode())
+
+
+def serve(path: str):
+    """
+    Serves `vpy` command lines on the Unix socket `path`, one at a time in the
+    daemon process. The analysis modules are imported and the type checker is
+    built once. Each analyzed module is kept, with its annotated tree, slicing
+    session, version graphs and class environments, until it or a local
+    module it imports changes.
+    """
+    import vpy.cli
+    import vpy.lib.transformers.module
+    import vpy.typechecker.pyanalyze.ast_annotator
+    from vpy.typechecker.pyanalyze.version_checker import shared_checker
+
+    shared_checker()
+    vpy.cli.warm_modules = {}
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.UnixStreamServer(path, __Handler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+
+def request(path: str, argv: list[str]) -> int | None:
+    """
+    Runs the command line `argv` in the daemon listening on `path`, printing
+    its output. Returns its exit status, or None if there is no daemon or it
+    did not send back a complete reply, in which case nothing is printed.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+            s.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode() + b"\n")
+            s.shutdown(socket.SHUT_WR)
+            with s.makefile("rb") as f:
+                response = json.load(f)
+        stdout, stderr, status = (
+            response["stdout"],
+            response["stderr"],
+            response["status"],
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not (
+        isinstance(stdout, str) and isinstance(stderr, str) and isinstance(status, int)
+    ):
+        return None
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return status
@@ -0,0 +1,159 @@
+import ast
+import glob
+import hashlib
+import json
+import os
+import sys
+from enum import Enum
+from functools import cache
+from typing import Any
+
+# Directory, next to each analyzed module, where analysis results are stored.
+CACHE_DIR = "__vpycache__"
+
+# Whether analysis results are read from and written to the cache.
+enabled = True
+
+# Whether analysis results are written to the cache. Commands that only read
+# the module, such as listing its versions, do not create the cache directory.
+writable = True
+
+# Content hash of each module file, guarded by its (mtime, size) so that the
+# file is only re-read and re-hashed when it changes on disk.
+__hashes: dict[str, tuple[tuple[int, int], str]] = {}
+
+# Local modules imported by each module file, guarded as `__hashes`.
+__imports: dict[str, tuple[tuple[int, int], tuple[str, ...]]] = {}
+
+
+def content_hash(file: str) -> str:
+    """
+    Returns the hash of the contents of `file`.
+    """
+    st = os.stat(file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = __hashes.get(file)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(file, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    __hashes[file] = (stamp, digest)
+    return digest
+
+
+def imported_files(file: str) -> tuple[str, ...]:
+    """
+    Returns the files of the modules imported by module `file` that are found
+    next to it, as its own directory comes first in the import path. Modules
+    of installed packages, and the modules imported by the imported modules,
+    are left out.
+    """
+    st = os.stat(file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = __imports.get(file)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(file, "rb") as f:
+            tree = ast.parse(f.read(), file)
+    except (SyntaxError, ValueError):
+        tree = ast.Module(body=[], type_ignores=[])
+    root = os.path.dirname(os.path.abspath(file))
+    names: list[tuple[str, list[str]]] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [(root, alias.name.split(".")) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            base = root
+            for _ in range(node.level - 1):
+                base = os.path.dirname(base)
+            parts = node.module.split(".") if node.module else []
+            names.append((base, parts))
+            # Imported names may be submodules of the imported package.
+            names += [(base, [*parts, alias.name]) for alias in node.names]
+    files = set()
+    for base, parts in names:
+        for i in range(1, len(parts) + 1):
+            path = os.path.join(base, *parts[:i])
+            for candidate in (f"{path}.py", os.path.join(path, "__init__.py")):
+                if os.path.isfile(candidate) and candidate != os.path.abspath(file):
+                    files.add(candidate)
+    imports = tuple(sorted(files))
+    __imports[file] = (stamp, imports)
+    return imports
+
+
+@cache
+def vpy_version() -> str:
+    """
+    Returns the version of vpy, together with a stamp of its build: the
+    modification times of its package directories, which change when vpy is
+    installed again or a checkout switches branches. Sources edited in place
+    are not noticed, so use --no-cache while working on vpy itself.
+    """
+    from vpy import __version__
+
+    stamp = hashlib.sha256()
+    for path, dirs, _ in os.walk(os.path.dirname(os.path.dirname(__file__))):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        stamp.update(f"{path}:{os.stat(path).st_mtime_ns}".encode())
+    return f"{__version__}+{stamp.hexdigest()[:16]}"
+
+
+def cache_path(file: str) -> str:
+    """
+    Returns the path of the cached analysis of module `file`, keyed by the
+    contents of the file and of the local modules it imports, and by the vpy
+    and python versions.
+    """
+    hashes = [content_hash(f) for f in (file, *imported_files(file))]
+    key = hashlib.sha256(
+        f"{':'.join(hashes)}:{vpy_version()}:{sys.implementation.cache_tag}".encode()
+    ).hexdigest()[:16]
+    name = f"{os.path.basename(file)}.{key}.json"
+    return os.path.join(os.path.dirname(os.path.abspath(file)), CACHE_DIR, name)
+
+
+def load_analysis(file: str) -> dict[str, Any]:
+    """
+    Returns the cached analysis of module `file`, or an empty analysis if
+    there is none for its current contents.
+    """
+    if not enabled:
+        return {}
+    try:
+        with open(cache_path(file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_analysis(file: str, analysis: dict[str, Any]):
+    """
+    Stores the analysis of module `file`, replacing any analysis of previous
+    contents of the file, unless the cache is not writable. Failing to write
+    the cache is not an error.
+    """
+    if not enabled or not writable:
+        return
+    path = cache_path(file)
+    prefix = os.path.join(os.path.dirname(path), f"{os.path.basename(file)}.")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for stale in glob.glob(f"{glob.escape(prefix)}*.json"):
+            if stale != path:
+                os.remove(stale)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(analysis, f, separators=(",", ":"), default=__encode)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def __encode(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
@@ -2,12 +2,22 @@
 This module provides useful types used throughout the codebase.
 """
 
-from ast import Attribute, Constant, FunctionDef, List, keyword, expr
-from collections import UserDict
-from copy import deepcopy
+from ast import (
+    Attribute,
+    Call,
+    ClassDef,
+    Constant,
+    FunctionDef,
+    List,
+    Name,
+    keyword,
+    expr,
+)
+import ast
+from collections import OrderedDict, UserDict
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING, NamedTuple, NewType
-from networkx import DiGraph
+from typing import TYPE_CHECKING, Callable, Iterable, Mapping, NamedTuple, NewType
+from weakref import WeakKeyDictionary
 
 if TYPE_CHECKING:
     from vpy.typechecker.pyanalyze.value import Value
@@ -38,53 +48,153 @@ class Version:
         return f"Version {self.name}"
 
 
-class Graph(DiGraph):
+class Graph:
+    """
+    Version graph of a class, with an edge from each version to the versions
+    it upgrades or replaces. Versions are indexed by name, and the edges of
+    each label are indexed in both directions.
+    """
+
     def __init__(self, *, graph: list[Version] = []):
-        super().__init__()
+        self.__versions: dict[VersionId, Version] = {}
+        for version in graph:
+            self.__versions.setdefault(version.name, version)
+        self.__upgraded_by: dict[VersionId, set[Version]] = {}
+        self.__replaced_by: dict[VersionId, set[Version]] = {}
+        # Labelled edges out of each version, in insertion order.
+        self.__edges: dict[Version, dict[Version, str]] = {}
         for version in graph:
-            self.add_node(version)
+            edges = self.__edges.setdefault(version, {})
             for upgrade in version.upgrades:
-                try:
-                    uv = next(v for v in graph if v.name == upgrade)
-                    self.add_edge(version, uv, label="upgrades")
-                except StopIteration:
-                    pass
+                self.__upgraded_by.setdefault(upgrade, set()).add(version)
+                if (uv := self.__versions.get(upgrade)) is not None:
+                    self.__edges.setdefault(uv, {})
+                    edges[uv] = "upgrades"
             for replace in version.replaces:
-                try:
-                    rv = next(v for v in graph if v.name == replace)
-                    self.add_edge(version, rv, label="replaces")
-                except StopIteration:
-                    pass
+                self.__replaced_by.setdefault(replace, set()).add(version)
+                if (rv := self.__versions.get(replace)) is not None:
+                    self.__edges.setdefault(rv, {})
+                    edges[rv] = "replaces"
+        self.__parents: dict[VersionId, set[Version]] = {
+            name: set(self.__edges[version])
+            for name, version in self.__versions.items()
+        }
+        self.names: frozenset[VersionId] = frozenset(self.__versions)
+        self.__ancestors: dict[VersionId, frozenset[VersionId]] | None = None
+        self.__descendants: dict[VersionId, frozenset[VersionId]] | None = None
+
+    def __len__(self) -> int:
+        return len(self.__edges)
 
     def find_version(self, v: VersionId) -> Version | None:
-        for version in self.all():
-            if version.name == v:
-                return version
-        return None
+        return self.__versions.get(v)
 
     def all(self) -> list[Version]:
-        return list(self.nodes)
+        return list(self.__edges)
 
     def parents(self, v: VersionId) -> set[Version]:
         """Returns the ids of versions that v either upgrades or replaces."""
-        return {e[1] for e in self.out_edges(self.find_version(v))}
-
-    def delete(self, v: VersionId) -> "Graph":
-        other = deepcopy(self)
-        version = other.find_version(v)
-        if version is None:
-            return other
-        other.remove_node(version)
-        for val in other.all():
-            val.upgrades = tuple(u for u in val.upgrades if u != v)
-            val.replaces = tuple(r for r in val.replaces if r != v)
-        return other
+        return self.__parents.get(v, set())
+
+    def label(self, u: Version, v: Version) -> str | None:
+        """
+        Returns how version u relates to version v ("upgrades" or "replaces").
+        """
+        return self.__edges.get(u, {}).get(v)
+
+    def ancestors(self, v: VersionId) -> frozenset[VersionId]:
+        """
+        Returns the versions that v transitively upgrades or replaces.
+        """
+        if self.__ancestors is None:
+            self.__transitive_closure()
+        assert self.__ancestors is not None
+        return self.__ancestors.get(v, frozenset())
+
+    def descendants(self, v: VersionId) -> frozenset[VersionId]:
+        """
+        Returns the versions that transitively upgrade or replace v.
+        """
+        if self.__descendants is None:
+            self.__transitive_closure()
+        assert self.__descendants is not None
+        return self.__descendants.get(v, frozenset())
+
+    def is_ancestor(self, u: VersionId, v: VersionId) -> bool:
+        """
+        Checks if v transitively upgrades or replaces u.
+        """
+        return u in self.ancestors(v)
+
+    def __transitive_closure(self) -> None:
+        order = self.topological_order()
+        ancestors: dict[VersionId, frozenset[VersionId]] = {}
+        for version in order:
+            ancestors[version.name] = frozenset(
+                a
+                for p in self.parents(version.name)
+                for a in ancestors[p.name] | {p.name}
+            )
+        descendants: dict[VersionId, set[VersionId]] = {w.name: set() for w in order}
+        for name, anc in ancestors.items():
+            for a in anc:
+                descendants[a].add(name)
+        self.__ancestors = ancestors
+        self.__descendants = {k: frozenset(d) for k, d in descendants.items()}
+
+    def delete(self, v: VersionId) -> "GraphView":
+        return GraphView(self, frozenset({v}))
+
+    def topological_order(self) -> list[Version]:
+        """
+        Returns the versions of this graph such that each version comes after
+        the versions it upgrades or replaces.
+        """
+        in_degree = {w: 0 for w in self.__edges}
+        for edges in self.__edges.values():
+            for w in edges:
+                in_degree[w] += 1
+        order = [w for w, d in in_degree.items() if d == 0]
+        for w in order:
+            for p in self.__edges[w]:
+                in_degree[p] -= 1
+                if in_degree[p] == 0:
+                    order.append(p)
+        if len(order) != len(in_degree):
+            raise ValueError("Version graph contains a cycle")
+        return list(reversed(order))
+
+    def find_cycle(self) -> list[tuple[Version, Version]] | None:
+        """
+        Returns the edges of a cycle in this graph, if there is one.
+        """
+        explored: set[Version] = set()
+        for start in self.__edges:
+            if start in explored:
+                continue
+            path: list[Version] = [start]
+            on_path = {start}
+            iters = [iter(self.__edges[start])]
+            while iters:
+                w = next(iters[-1], None)
+                if w is None:
+                    iters.pop()
+                    explored.add(on_path_pop := path.pop())
+                    on_path.discard(on_path_pop)
+                elif w in on_path:
+                    cycle = path[path.index(w) :] + [w]
+                    return list(zip(cycle, cycle[1:]))
+                elif w not in explored:
+                    path.append(w)
+                    on_path.add(w)
+                    iters.append(iter(self.__edges[w]))
+        return None
 
     def replacements(self, v: VersionId) -> set[Version]:
-        return {w for w in self.all() if v in w.replaces}
+        return self.__replaced_by.get(v, set())
 
     def branches(self, v: VersionId) -> set[Version]:
-        return {w for w in self.all() if v in w.upgrades}
+        return self.__upgraded_by.get(v, set())
 
     def tree(self):
         tree = []
@@ -99,12 +209,138 @@ class Graph(DiGraph):
             }
             return node
 
-        roots = [node for node, out_degree in self.out_degree if out_degree == 0]
+        roots = [node for node, edges in self.__edges.items() if edges == {}]
         for node in roots:
             tree.append(make_tree_node(self, node))
         return tree
 
 
+class GraphView:
+    """
+    A version graph without some of its versions. Views share the versions
+    and edges of the underlying graph instead of copying them.
+    """
+
+    def __init__(self, graph: Graph, hidden: frozenset[VersionId]):
+        self.graph = graph
+        self.hidden = hidden
+        self.names: frozenset[VersionId] = graph.names - hidden
+
+    def find_version(self, v: VersionId) -> Version | None:
+        if v in self.hidden:
+            return None
+        return self.graph.find_version(v)
+
+    def all(self) -> list[Version]:
+        return [w for w in self.graph.all() if w.name not in self.hidden]
+
+    def parents(self, v: VersionId) -> set[Version]:
+        """Returns the ids of versions that v either upgrades or replaces."""
+        if v in self.hidden:
+            return set()
+        return {p for p in self.graph.parents(v) if p.name not in self.hidden}
+
+    def delete(self, v: VersionId) -> "GraphView":
+        return GraphView(self.graph, self.hidden | {v})
+
+    def replacements(self, v: VersionId) -> set[Version]:
+        if v in self.hidden:
+            return set()
+        return {w for w in self.graph.replacements(v) if w.name not in self.hidden}
+
+    def branches(self, v: VersionId) -> set[Version]:
+        if v in self.hidden:
+            return set()
+        return {w for w in self.graph.branches(v) if w.name not in self.hidden}
+
+    def topological_order(self) -> list[Version]:
+        return [w for w in self.graph.topological_order() if w.name not in self.hidden]
+
+
+type VersionGraph = Graph | GraphView
+
+
+class GraphCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+# Maximum number of version graphs kept by `graph` for classes that are
+# parsed again (e.g. by a daemon, or across the files of a batch).
+graph_cache_size = 256
+
+# Version graph of each class, kept as long as the class.
+__class_graphs: WeakKeyDictionary[ClassDef, Graph] = WeakKeyDictionary()
+
+# Version graphs by the `@version` decorators they are built from, least
+# recently used first.
+__graphs: OrderedDict[tuple[str, ...], Graph] = OrderedDict()
+__graph_stats = [0, 0]
+
+
+def __named_version(d: Call) -> bool:
+    return any(
+        k.arg == "name"
+        and isinstance(k.value, Constant)
+        and isinstance(k.value.value, str)
+        for k in d.keywords
+    )
+
+
+def graph(cls: ClassDef) -> Graph:
+    """
+    Build a version graph for class `cls`. Graphs are shared by every class
+    with the same `@version` decorators, so a class that is parsed again
+    reuses its graph as long as its versions do not change. Versions whose
+    name is not a literal string are left out; the checker reports them.
+    """
+    if cls in __class_graphs:
+        return __class_graphs[cls]
+    decorators = [
+        d
+        for d in cls.decorator_list
+        if isinstance(d, Call)
+        and isinstance(d.func, Name)
+        and d.func.id == "version"
+        and __named_version(d)
+    ]
+    key = tuple(ast.dump(d) for d in decorators)
+    g = __graphs.get(key)
+    if g is not None:
+        __graph_stats[0] += 1
+        __graphs.move_to_end(key)
+    else:
+        __graph_stats[1] += 1
+        g = __graphs[key] = Graph(graph=[Version(d.keywords) for d in decorators])
+        while len(__graphs) > graph_cache_size:
+            __graphs.popitem(last=False)
+    __class_graphs[cls] = g
+    return g
+
+
+def graph_cache_info() -> GraphCacheInfo:
+    """
+    Returns the statistics of the graphs shared by `graph`: the hits and
+    misses count the classes whose graph was first requested.
+    """
+    return GraphCacheInfo(
+        hits=__graph_stats[0],
+        misses=__graph_stats[1],
+        maxsize=graph_cache_size,
+        currsize=len(__graphs),
+    )
+
+
+def graph_cache_clear() -> None:
+    """
+    Drops the graphs shared by `graph` and resets their statistics.
+    """
+    __graphs.clear()
+    __graph_stats[:] = [0, 0]
+
+
 class Lens(NamedTuple):
     v_from: VersionId
     v_target: VersionId
@@ -142,6 +378,89 @@ class Lenses(UserDict[VersionId, dict[VersionId, dict[str, Lens]]]):
         return None
 
 
+class LazyLenses(Lenses):
+    """
+    Lenses whose table out of each version of `versions` is computed by
+    `lenses_from` the first time it is looked up. Iterating over the lenses
+    computes the tables of every version.
+    """
+
+    def __init__(
+        self,
+        versions: Iterable[VersionId],
+        lenses_from: Callable[[VersionId], Mapping[VersionId, dict[str, Lens]]],
+    ):
+        super().__init__()
+        self.versions = frozenset(versions)
+        self.__lenses_from = lenses_from
+
+    def __missing__(self, v_from: VersionId) -> Mapping[VersionId, dict[str, Lens]]:
+        if v_from not in self.versions:
+            raise KeyError(v_from)
+        lenses = self.data[v_from] = self.__lenses_from(v_from)
+        return lenses
+
+    def __contains__(self, v_from: object) -> bool:
+        return v_from in self.data or v_from in self.versions
+
+    def __iter__(self):
+        for v in self.versions:
+            self[v]
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        return len(self.versions | self.data.keys())
+
+    def find_lens(
+        self, *, v_from: VersionId, v_to: VersionId, attr: str
+    ) -> Lens | None:
+        try:
+            return self[v_from][v_to][attr]
+        except KeyError:
+            return None
+
+    def add_lens(
+        self,
+        v_from: VersionId,
+        v_to: VersionId,
+        attr: str,
+        lens_node: FunctionDef | None,
+    ) -> None:
+        if v_from in self.versions:
+            self[v_from]
+        super().add_lens(v_from, v_to, attr, lens_node)
+
+
+class LazyTable[T](UserDict[VersionId, T]):
+    """
+    Table by version whose entry for each version of `versions` is computed
+    by `entry` the first time it is looked up. Iterating over the table
+    computes the entries of every version.
+    """
+
+    def __init__(self, versions: Iterable[VersionId], entry: Callable[[VersionId], T]):
+        super().__init__()
+        self.versions = frozenset(versions)
+        self.__entry = entry
+
+    def __missing__(self, v: VersionId) -> T:
+        if v not in self.versions:
+            raise KeyError(v)
+        value = self.data[v] = self.__entry(v)
+        return value
+
+    def __contains__(self, v: object) -> bool:
+        return v in self.data or v in self.versions
+
+    def __iter__(self):
+        for v in self.versions:
+            self[v]
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        return len(self.versions | self.data.keys())
+
+
 class Field(NamedTuple):
     name: str
     type: "Value"
@@ -176,6 +495,8 @@ class ClassEnvironment:
     put_lenses: Lenses = field(default_factory=Lenses)
     method_lenses: Lenses = field(default_factory=Lenses)
     versions: "Graph" = field(default_factory=Graph)
+    # Names of the lens definitions of the class.
+    lens_names: frozenset[str] = frozenset()
 
 
 @dataclass
@@ -189,3 +510,5 @@ class Environment:
     put_lenses: dict[str, Lenses] = field(default_factory=dict)
     method_lenses: dict[str, Lenses] = field(default_factory=dict)
     versions: dict[str, "Graph"] = field(default_factory=dict)
+    classes: dict[str, ClassDef] = field(default_factory=dict)
+    lens_names: dict[str, frozenset[str]] = field(default_factory=dict)
@@ -1,14 +1,27 @@
 import ast
-from ast import ClassDef, FunctionDef, NodeVisitor
-from vpy.lib.lib_types import Field, Graph, Lenses, VersionId, VersionedMethod
+from ast import ClassDef, FunctionDef, Module
+from typing import Callable
+from weakref import WeakKeyDictionary
+from vpy.lib.lib_types import (
+    Field,
+    LazyTable,
+    Lens,
+    Lenses,
+    Version,
+    VersionGraph,
+    VersionId,
+    VersionedMethod,
+)
 from vpy.lib.utils import (
     fields_in_function,
     get_decorators,
     is_lens,
     get_at,
+    get_to,
+    object_attributes,
+    typeof_node,
 )
 from vpy.lib.visitors.fields import ClassFieldCollector
-from vpy.lib.visitors.methods import MethodCollector
 
 
 class MethodConflictException(Exception):
@@ -17,406 +30,862 @@ class MethodConflictException(Exception):
         super().__init__(message)
 
 
-def base_versions(g: Graph, cls_ast: ClassDef, v: VersionId) -> set[VersionId]:
-    fields_v = fields_at(g=g, cls_ast=cls_ast, v=v)
-    if len(fields_v) > 0:
-        return {v}
-    else:
-        base_p: set[VersionId] = set()
-        for p in g.parents(v):
-            back = base_versions(g, cls_ast, p.name)
-            base_p = base_p.union(back)
-        return base_p
-
-
-def field_lenses_lookup(g: Graph, cls_ast: ClassDef) -> Lenses:
-    lenses = Lenses()
-    for k in g.all():
-        for t in g.all():
-            if k != t:
-                lens = __field_lens_lookup(g, k.name, t.name, cls_ast)
-                if len(lens) == 0 and k.name not in lenses.data:
-                    lenses.data[k.name] = {}
-                else:
-                    for field, lens_node in lens.items():
-                        lenses.add_lens(
-                            v_from=t.name,
-                            v_to=k.name,
-                            attr=field.name,
-                            lens_node=lens_node,
-                        )
-    return lenses
-
-
-def method_lenses_lookup(g: Graph, cls_ast: ClassDef) -> Lenses:
-    lenses = Lenses()
-    for k in g.all():
-        for t in g.all():
-            if k != t:
-                if lens := __method_lens_lookup(g, k.name, t.name, cls_ast):
-                    for method, lens_node in lens.items():
-                        lenses.add_lens(
-                            v_from=k.name,
-                            attr=method,
-                            v_to=t.name,
-                            lens_node=lens_node,
-                        )
-    return lenses
-
-
-def fields_lookup(g: Graph, cls_ast: ClassDef, v: VersionId) -> set[Field]:
-    """
-    Returns the set of fields defined for version v.
-    These may be explictly defined at v or inherited from some other related version(s).
-    """
+type GraphKey = frozenset[VersionId]
 
-    base_v = base_versions(g, cls_ast, v)
-    base_fields: set[Field] = set()
-    if base_v == {v}:
-        return fields_at(g, cls_ast, v)
-    else:
-        for w in base_v:
-            base_fields = base_fields.union(fields_lookup(g, cls_ast, w))
-        return base_fields
+# Attribute of a version, which lenses rewrite between versions.
+type LensNode = tuple[VersionId, str]
 
 
-def methods_lookup(
-    g: Graph, cls_ast: ClassDef, v: VersionId, *, _except: bool = False
-) -> set[VersionedMethod]:
+def graph_key(g: VersionGraph) -> GraphKey:
     """
-    Returns the methods of a class available at version v. These may be
-    explictly defined at v or inherited from some other related version(s).
+    Returns a key identifying graph `g` among the graphs derived (by deleting
+    versions) from the version graph of a class.
     """
+    return g.names
 
-    class MethodCollector(NodeVisitor):
-        def __init__(self):
-            self.methods: set[VersionedMethod] = set()
-
-        def visit_ClassDef(self, node: ClassDef):
-            self.generic_visit(node)
-
-        def visit_FunctionDef(self, node: FunctionDef):
-            if not is_lens(node):
-                try:
-                    mdef = _method_lookup(g, cls_ast, node.name, v)
-                    if mdef is not None:
-                        self.methods.add(mdef)
-                except MethodConflictException as e:
-                    if _except:
-                        raise e
-                    return
-
-    visitor = MethodCollector()
-    visitor.visit(cls_ast)
-    return visitor.methods
 
+class DecoratorIndex:
+    """
+    The versioned definitions of a class, indexed by their decorators in a
+    single pass over the class: the methods defined at each version, the
+    names of the lenses, and the get lenses as edges between versions. Lens
+    `(v, t, attr)` is an edge from version `v`, where it is defined, to
+    version `t`, whose attribute `attr` it provides.
+    """
 
-# Auxiliary methods
+    def __init__(self, cls_ast: ClassDef):
+        self.body = tuple(cls_ast.body)
+        # Methods that are not lenses, in the order in which they are defined.
+        self.methods: list[FunctionDef] = []
+        self.edges: dict[tuple[VersionId, VersionId, str], FunctionDef] = {}
+        self.__into: dict[VersionId, dict[str, dict[VersionId, FunctionDef]]] = {}
+        self.__out_of: dict[VersionId, dict[str, dict[VersionId, FunctionDef]]] = {}
+        self.__methods_at: dict[VersionId, set[FunctionDef]] | None = None
+        lens_names: set[str] = set()
+        for method in cls_ast.body:
+            if isinstance(method, FunctionDef):
+                if is_lens(method):
+                    lens_names.add(method.name)
+                decorators = get_decorators(method, "get")
+                if len(decorators) > 0:
+                    decorator = decorators[0]
+                    at, target, attr = [
+                        a.value for a in decorator.args if isinstance(a, ast.Constant)
+                    ]
+                    self.edges[(at, target, attr)] = method
+                    self.__into.setdefault(target, {}).setdefault(attr, {})[at] = method
+                    self.__out_of.setdefault(at, {}).setdefault(attr, {})[
+                        target
+                    ] = method
+        self.lens_names = frozenset(lens_names)
+        stack = list(reversed(cls_ast.body))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, FunctionDef):
+                if not is_lens(node):
+                    self.methods.append(node)
+            else:
+                stack.extend(reversed(list(ast.iter_child_nodes(node))))
+
+    def into(self, t: VersionId) -> dict[str, dict[VersionId, FunctionDef]]:
+        """
+        Returns the lenses targetting version t, by attribute and source version.
+        """
+        return self.__into.get(t, {})
+
+    def out_of(self, v: VersionId) -> dict[str, dict[VersionId, FunctionDef]]:
+        """
+        Returns the lenses defined at version v, by attribute and target version.
+        """
+        return self.__out_of.get(v, {})
+
+    def methods_at(self, v: VersionId) -> set[FunctionDef]:
+        """
+        Returns the methods explicitly defined at version v. The methods are
+        grouped by version the first time they are requested, since every
+        method must then be defined at exactly one version.
+        """
+        if self.__methods_at is None:
+            methods_at: dict[VersionId, set[FunctionDef]] = {}
+            for method in self.methods:
+                methods_at.setdefault(get_at(method), set()).add(method)
+            self.__methods_at = methods_at
+        return self.__methods_at.get(v, set())
+
+
+# Decorator index of each class, kept as long as the class and rebuilt when
+# the definitions in the body of the class change.
+__indexes: WeakKeyDictionary[ClassDef, DecoratorIndex] = WeakKeyDictionary()
+
+
+def decorator_index(cls_ast: ClassDef) -> DecoratorIndex:
+    """
+    Returns the decorator index of class `cls_ast`.
+    """
+    index = __indexes.get(cls_ast)
+    if index is None or index.body != tuple(cls_ast.body):
+        index = __indexes[cls_ast] = DecoratorIndex(cls_ast)
+    return index
 
 
-# TODO: Refactor this, v should be first arg to decorator (at)
-def __field_lenses_at(
-    g: Graph, cls_ast: ClassDef, v: VersionId
-) -> dict[str, dict[VersionId, FunctionDef]]:
+def shortest_lens_paths(
+    lenses: list[tuple[FunctionDef, LensNode, set[LensNode]]],
+    inherited: Callable[[LensNode], list[LensNode]] = lambda node: [],
+) -> dict[LensNode, FunctionDef]:
     """
-    Returns the lenses explicitly defined at version v.
+    Returns the first lens of a shortest lens path to each node, found by a
+    breadth-first search over `lenses`. Each lens provides its node once
+    every node it requires is provided, one step after the last of them. Of
+    the lenses providing a node in the same step, the first one in `lenses`
+    is chosen. A provided node also provides the nodes `inherited` from it,
+    in the same step and by the same lens.
     """
-    lenses: dict[str, dict[VersionId, FunctionDef]] = {}
-    for method in cls_ast.body:
-        if isinstance(method, FunctionDef):
-            decorators = get_decorators(method, "get")
-            if len(decorators) > 0:
-                decorator = decorators[0]
-                at, target, field = [
-                    a.value for a in decorator.args if isinstance(a, ast.Constant)
-                ]
-                if (
-                    v == target
-                    and g.find_version(v) is not None
-                    and g.find_version(target) is not None
-                ):
-                    if field not in lenses:
-                        lenses[field] = {}
-                    lenses[field][at] = method
-    return lenses
-
-
-def __method_lenses_at(
-    g: Graph, cls_ast: ClassDef, v: VersionId
-) -> dict[str, dict[VersionId, FunctionDef]]:
+    first: dict[LensNode, FunctionDef] = {}
+    waiting: dict[LensNode, list[int]] = {}
+    missing = [len(refs) for _, _, refs in lenses]
+    step = [i for i, count in enumerate(missing) if count == 0]
+    for i, (_, _, refs) in enumerate(lenses):
+        for ref in refs:
+            waiting.setdefault(ref, []).append(i)
+    while step:
+        reached: list[LensNode] = []
+        for i in sorted(step):
+            lens, node, _ = lenses[i]
+            if node not in first:
+                first[node] = lens
+                reached.append(node)
+        for node in sorted(reached):
+            for other in inherited(node):
+                if other not in first:
+                    first[other] = first[node]
+                    reached.append(other)
+        step = []
+        for node in reached:
+            for i in waiting.pop(node, []):
+                missing[i] -= 1
+                if missing[i] == 0:
+                    step.append(i)
+    return first
+
+
+class ClassLookup:
     """
-    Returns the lenses explicitly defined at version v.
+    Lookup context for a single class. The facts computed for each version of
+    `cls_ast` are memoized, keyed by version and by the graph being used, so
+    that a context should only live as long as `cls_ast` is not modified.
     """
-    lenses: dict[str, dict[VersionId, FunctionDef]] = {}
-    for method in cls_ast.body:
-        if isinstance(method, FunctionDef):
-            decorators = get_decorators(method, "get")
-            if len(decorators) > 0:
-                decorator = decorators[0]
-                at, target, field = [
-                    a.value for a in decorator.args if isinstance(a, ast.Constant)
-                ]
-                if v == at and g.find_version(v) is not None:
-                    if field not in lenses:
-                        lenses[field] = {}
-                    lenses[field][target] = method
-    return lenses
 
+    def __init__(self, cls_ast: ClassDef):
+        self.cls_ast = cls_ast
+        self.index = decorator_index(cls_ast)
+        self.__versions: dict[GraphKey, list[Version]] = {}
+        self.__fields_at: dict[tuple[GraphKey, VersionId], set[Field]] = {}
+        self.__base_versions: dict[tuple[GraphKey, VersionId], set[VersionId]] = {}
+        self.__fields_lookup: dict[tuple[GraphKey, VersionId], set[Field]] = {}
+        self.__method_lookup: dict[
+            tuple[GraphKey, str, VersionId],
+            VersionedMethod | None | MethodConflictException,
+        ] = {}
+        # First lens of the shortest lens path of each attribute of each
+        # version, from (fields) or to (methods) a given version.
+        self.__field_paths: dict[
+            tuple[GraphKey, VersionId], dict[LensNode, FunctionDef]
+        ] = {}
+        self.__method_paths: dict[
+            tuple[GraphKey, VersionId], dict[LensNode, FunctionDef]
+        ] = {}
+        self.__references: dict[tuple[FunctionDef, frozenset[Field]], set[Field]] = {}
+        # Field lens paths of a previous version of the class, to be kept if
+        # the facts of its edited definitions did not change (see `update`).
+        self.__kept_field_paths: (
+            tuple[
+                dict[tuple[GraphKey, VersionId], dict[LensNode, FunctionDef]],
+                list[tuple[FunctionDef, object]],
+            ]
+            | None
+        ) = None
+
+    def update(self, cls_ast: ClassDef) -> "ClassLookup":
+        """
+        Returns a lookup of class `cls_ast`, an edit of the annotated class of
+        this lookup, that keeps the method lookups and lens paths memoized so
+        far if the edit does not affect them. Only edits to the bodies of
+        methods and lenses are tracked: any other edit gives a new lookup.
+        Method lookups and method lens paths do not depend on bodies, so they
+        are kept right away, before `cls_ast` is annotated. Field lens paths
+        only depend on the names of the fields of each version and of the
+        fields read by each lens, so they are kept unless an edited method
+        changes the names of the fields assigned at its version or an edited
+        lens changes the attributes it reads, which is only known once
+        `cls_ast` is annotated. The fields themselves are looked up again, as
+        their types are inferred anew.
+        """
+        lookup = ClassLookup(cls_ast)
+        edit = self.__edited_definitions(lookup)
+        if edit is None:
+            return lookup
+        nodes, edited = edit
+
+        def rebind(m: VersionedMethod | None | MethodConflictException):
+            if m is None:
+                return None
+            if isinstance(m, MethodConflictException):
+                return MethodConflictException({nodes[d] for d in m.definitions})
+            return VersionedMethod(m.name, nodes[m.interface], nodes[m.implementation])
+
+        def rebind_paths(paths: dict[LensNode, FunctionDef]):
+            return {node: nodes[lens] for node, lens in paths.items()}
+
+        lookup.__method_lookup = {k: rebind(m) for k, m in self.__method_lookup.items()}
+        lookup.__method_paths = {
+            k: rebind_paths(paths) for k, paths in self.__method_paths.items()
+        }
+        if self.__field_paths:
+            lookup.__kept_field_paths = (
+                {k: rebind_paths(paths) for k, paths in self.__field_paths.items()},
+                [(new, self.__path_facts(old)) for old, new in edited],
+            )
+        return lookup
+
+    def __path_facts(self, d: FunctionDef) -> object:
+        """
+        Returns the facts about definition `d` on which the field lens paths
+        depend: the attributes read by a lens, or the names of the fields
+        assigned at the version of a method.
+        """
+        if is_lens(d):
+            return lens_attributes(d)
+        return {
+            f.name: explicit
+            for f, explicit in self.__assigned_fields(get_at(d)).items()
+        }
+
+    def __edited_definitions(
+        self, lookup: "ClassLookup"
+    ) -> (
+        tuple[dict[FunctionDef, FunctionDef], list[tuple[FunctionDef, FunctionDef]]]
+        | None
+    ):
+        """
+        Matches the methods and lenses of this lookup with those of `lookup`,
+        a lookup of an edit of the class, returning the definition matching
+        each one and the pairs of definitions whose bodies were edited.
+        Returns None if the edit changes anything other than those bodies.
+        """
+        old_ast, cls_ast = self.cls_ast, lookup.cls_ast
+        old_index, index = self.index, lookup.index
+        if (
+            old_ast.name != cls_ast.name
+            or len(old_ast.body) != len(cls_ast.body)
+            or old_index.edges.keys() != index.edges.keys()
+            or len(old_index.methods) != len(index.methods)
+            or any(
+                ast.dump(old) != ast.dump(new)
+                for old, new in [
+                    *zip(old_ast.decorator_list, cls_ast.decorator_list),
+                    *zip(old_ast.bases, cls_ast.bases),
+                ]
+            )
+            or len(old_ast.decorator_list) != len(cls_ast.decorator_list)
+            or len(old_ast.bases) != len(cls_ast.bases)
+        ):
+            return None
+        nodes = dict(zip(old_index.methods, index.methods))
+        nodes.update({old_index.edges[k]: index.edges[k] for k in index.edges})
+        edited = []
+        for old, new in zip(old_ast.body, cls_ast.body):
+            if ast.dump(old) == ast.dump(new):
+                continue
+            if not (
+                isinstance(old, FunctionDef)
+                and isinstance(new, FunctionDef)
+                and nodes.get(old) is new
+                and old.name == new.name
+                and all(
+                    ast.dump(a) == ast.dump(b)
+                    for a, b in [
+                        *zip(old.decorator_list, new.decorator_list),
+                        (old.args, new.args),
+                    ]
+                )
+                and len(old.decorator_list) == len(new.decorator_list)
+                and ast.dump(old.returns or ast.Pass())
+                == ast.dump(new.returns or ast.Pass())
+                # Nested definitions are indexed as methods.
+                and not any(
+                    isinstance(n, FunctionDef) for b in new.body for n in ast.walk(b)
+                )
+            ):
+                return None
+            edited.append((old, new))
+        return nodes, edited
+
+    def versions(self, g: VersionGraph) -> list[Version]:
+        """
+        Returns the versions of `g` in topological order, where each version
+        comes after the versions it upgrades or replaces. The fields and base
+        versions of every version in `g` are computed along the way, in a
+        single pass over the graph.
+        """
+        gkey = graph_key(g)
+        if gkey not in self.__versions:
+            order = g.topological_order()
+            for version in order:
+                self.__version_step(g, gkey, version.name)
+            self.__versions[gkey] = order
+        return self.__versions[gkey]
+
+    def __version_step(self, g: VersionGraph, gkey: GraphKey, v: VersionId) -> None:
+        """
+        Computes the fields and base versions of `v`, assuming those of its
+        parent versions were already computed.
+        """
+        key = (gkey, v)
+        parents = g.parents(v)
+        parent_fields = {f for p in parents for f in self.__fields_at[(gkey, p.name)]}
+        fields_v = self.__local_fields(v, parent_fields)
+        self.__fields_at[key] = fields_v
+        if len(fields_v) > 0:
+            self.__base_versions[key] = {v}
+            self.__fields_lookup[key] = fields_v
+        else:
+            base_p: set[VersionId] = set()
+            for p in parents:
+                base_p = base_p.union(self.__base_versions[(gkey, p.name)])
+            self.__base_versions[key] = base_p
+            self.__fields_lookup[key] = {
+                f for w in base_p for f in self.__fields_at[(gkey, w)]
+            }
+
+    def base_versions(self, g: VersionGraph, v: VersionId) -> set[VersionId]:
+        key = (graph_key(g), v)
+        if key not in self.__base_versions:
+            self.__lookup_version(g, v)
+        return self.__base_versions[key]
+
+    def field_lenses_lookup(self, g: VersionGraph) -> Lenses:
+        lenses = Lenses()
+        for k in g.all():
+            for t in g.all():
+                if k != t:
+                    lens = self.__field_lens_lookup(g, k.name, t.name)
+                    if len(lens) == 0 and k.name not in lenses.data:
+                        lenses.data[k.name] = {}
+                    else:
+                        for field, lens_node in lens.items():
+                            lenses.add_lens(
+                                v_from=t.name,
+                                v_to=k.name,
+                                attr=field.name,
+                                lens_node=lens_node,
+                            )
+        return lenses
+
+    def method_lenses_lookup(self, g: VersionGraph) -> Lenses:
+        lenses = Lenses()
+        for k in g.all():
+            for t in g.all():
+                if k != t:
+                    if lens := self.__method_lens_lookup(g, k.name, t.name):
+                        for method, lens_node in lens.items():
+                            lenses.add_lens(
+                                v_from=k.name,
+                                attr=method,
+                                v_to=t.name,
+                                lens_node=lens_node,
+                            )
+        return lenses
+
+    def field_lenses_from(
+        self, g: VersionGraph, v: VersionId
+    ) -> LazyTable[dict[str, Lens]]:
+        """
+        Returns the field lenses of `field_lenses_lookup` out of version v, by
+        target version and field. The lenses to each target version are only
+        looked up when that version is.
+        """
+
+        def lenses_to(k: VersionId) -> dict[str, Lens]:
+            lenses: dict[str, Lens] = {}
+            for field, node in self.__field_lens_lookup(g, k, v).items():
+                target = k if node is None else get_to(node)
+                lenses.setdefault(
+                    field.name,
+                    Lens(v_from=v, v_target=target, attr=field.name, node=node),
+                )
+            return lenses
+
+        return LazyTable(g.names - {v}, lenses_to)
+
+    def method_lenses_from(
+        self, g: VersionGraph, v: VersionId
+    ) -> LazyTable[dict[str, Lens]]:
+        """
+        Returns the method lenses of `method_lenses_lookup` out of version v,
+        by target version and method. The lenses to each target version are
+        only looked up when that version is.
+        """
+
+        def lenses_to(t: VersionId) -> dict[str, Lens]:
+            return {
+                method: Lens(v_from=v, v_target=get_to(node), attr=method, node=node)
+                for method, node in self.__method_lens_lookup(g, v, t).items()
+            }
+
+        return LazyTable(g.names - {v}, lenses_to)
+
+    def fields_lookup(self, g: VersionGraph, v: VersionId) -> set[Field]:
+        """
+        Returns the set of fields defined for version v.
+        These may be explictly defined at v or inherited from some other related version(s).
+        """
+        key = (graph_key(g), v)
+        if key not in self.__fields_lookup:
+            self.__lookup_version(g, v)
+        return self.__fields_lookup[key]
+
+    def methods_lookup(
+        self, g: VersionGraph, v: VersionId, *, _except: bool = False
+    ) -> set[VersionedMethod]:
+        """
+        Returns the methods of a class available at version v. These may be
+        explictly defined at v or inherited from some other related version(s).
+        """
+
+        methods: set[VersionedMethod] = set()
+        for node in self.index.methods:
+            try:
+                mdef = self.method_lookup(g, node.name, v)
+                if mdef is not None:
+                    methods.add(mdef)
+            except MethodConflictException as e:
+                if _except:
+                    raise e
+        return methods
+
+    # Auxiliary methods
+
+    # TODO: Refactor this, v should be first arg to decorator (at)
+    def __field_lenses_at(
+        self, g: VersionGraph, v: VersionId
+    ) -> dict[str, dict[VersionId, FunctionDef]]:
+        """
+        Returns the lenses explicitly defined at version v.
+        """
+        if g.find_version(v) is None:
+            return {}
+        return self.index.into(v)
+
+    def __lens_references(self, lens: FunctionDef, fields: set[Field]) -> set[Field]:
+        """
+        Returns the references to `fields` in `lens`.
+        """
+        key = (lens, frozenset(fields))
+        if key not in self.__references:
+            self.__references[key] = fields_in_function(lens, fields)
+        return self.__references[key]
+
+    def __field_lens_paths(
+        self, g: VersionGraph, t: VersionId
+    ) -> dict[LensNode, FunctionDef]:
+        """
+        Returns the first lens of the shortest lens path that rewrites each
+        field of each version from version t, by version and field. Lens
+        `(w, v, f)` can be followed once every field of w that it reads can be
+        rewritten from t, or right away if w is t or one of its base versions.
+        Lenses into t or its base versions are only followed out of them. A
+        field that no lens provides at a version is rewritten as in the base
+        versions of that version.
+        """
+        if self.__kept_field_paths is not None:
+            paths, edited = self.__kept_field_paths
+            self.__kept_field_paths = None
+            if all(self.__path_facts(d) == facts for d, facts in edited):
+                self.__field_paths.update(paths)
+        key = (graph_key(g), t)
+        if key not in self.__field_paths:
+            bases_t = self.base_versions(g, t)
+            # Lenses out of t come first, then in the order they are defined.
+            lenses: list[tuple[bool, int, FunctionDef, LensNode, set[LensNode]]] = []
+            for order, ((w, v, f), lens) in enumerate(self.index.edges.items()):
+                if w not in g.names or v not in g.names:
+                    continue
+                refs: set[LensNode] = set()
+                if w != t and w not in bases_t:
+                    # The fields of t and of its base versions are at hand.
+                    if v == t or v in bases_t:
+                        continue
+                    fields_w = self.fields_lookup(g, w)
+                    refs = {
+                        (w, ref.name) for ref in self.__lens_references(lens, fields_w)
+                    }
+                lenses.append((w != t, order, lens, (v, f), refs))
+            # Versions that take their fields from each base version.
+            inheriting: dict[VersionId, list[VersionId]] = {}
+            for v in sorted(g.names):
+                bases_v = self.base_versions(g, v)
+                if bases_v != {v}:
+                    for w in sorted(bases_v):
+                        inheriting.setdefault(w, []).append(v)
+
+            def inherited(node: LensNode) -> list[LensNode]:
+                w, f = node
+                return [
+                    (v, f)
+                    for v in inheriting.get(w, [])
+                    if f not in self.__field_lenses_at(g, v)
+                ]
 
-def __field_lens_path_lookup(
-    g: Graph, v: VersionId, t: VersionId, cls_ast: ClassDef, field: str
-) -> list[FunctionDef] | None:
-    """
-    Returns a list of lenses to rewrite field from version v to version t
-    """
-    # TODO: Fix this after refactoring __lenses_at
-    lenses = __field_lenses_at(g=g, cls_ast=cls_ast, v=v)
-    if field not in lenses:
-        bases_v = base_versions(g, cls_ast, v)
-        if bases_v != {v}:
-            result: list[FunctionDef] = []
-            for w in bases_v:
-                path = __field_lens_path_lookup(g, w, t, cls_ast, field)
-                if path is not None:
-                    result += path
-            if result != []:
-                return result
-        return None
-    if t in lenses[field]:
-        return [lenses[field][t]]
-    else:
-        base_t = base_versions(g, cls_ast, t)
-        for w, lens in lenses[field].items():
-            if w in base_t:
-                return __field_lens_path_lookup(g, v, w, cls_ast, field)
-            result = [lens]
-            fields_w = fields_lookup(g, cls_ast, w)
-            references = fields_in_function(lens, fields_w)
-            for ref in references:
-                path = __field_lens_path_lookup(g.delete(v), w, t, cls_ast, ref.name)
-                if path is None:
-                    break
-                result += path
+            self.__field_paths[key] = shortest_lens_paths(
+                [lens[2:] for lens in sorted(lenses)], inherited
+            )
+        return self.__field_paths[key]
+
+    def __method_lens_paths(
+        self, g: VersionGraph, t: VersionId
+    ) -> dict[LensNode, FunctionDef]:
+        """
+        Returns the first lens of the shortest lens path that rewrites each
+        method of each version to version t, by version and method. Lens
+        `(v, w, m)` can be followed once every method defined at w can be
+        rewritten to t, or right away if w is t.
+        """
+        key = (graph_key(g), t)
+        if key not in self.__method_paths:
+            # Lenses into t come first, then in the order they are defined.
+            lenses: list[tuple[bool, int, FunctionDef, LensNode, set[LensNode]]] = []
+            for order, ((v, w, m), lens) in enumerate(self.index.edges.items()):
+                if v not in g.names or w not in g.names:
+                    continue
+                refs: set[LensNode] = set()
+                if w != t:
+                    refs = {(w, method.name) for method in self.methods_at(w)}
+                lenses.append((w != t, order, lens, (v, m), refs))
+
+            self.__method_paths[key] = shortest_lens_paths(
+                [lens[2:] for lens in sorted(lenses)]
+            )
+        return self.__method_paths[key]
+
+    def __field_lens_lookup(
+        self, g: VersionGraph, v: VersionId, t: VersionId
+    ) -> dict[Field, FunctionDef | None]:
+        """
+        Returns the field lenses from v to t.
+        """
+        fields_v = self.fields_lookup(g, v)
+        result: dict[Field, FunctionDef | None] = {}
+        bases_v = self.base_versions(g, v)
+        bases_t = self.base_versions(g, t)
+        paths = self.__field_lens_paths(g, t)
+        for field in fields_v:
+            lens = paths.get((v, field.name))
+            if lens is None:
+                if bases_v <= bases_t or field in self.fields_lookup(g, t):
+                    result[field] = None
+            else:
+                result[field] = lens
+        return result
+
+    def __method_lens_lookup(
+        self, g: VersionGraph, v: VersionId, t: VersionId
+    ) -> dict[str, FunctionDef]:
+        """
+        Returns the method lenses from v to t.
+        """
+        methods_v = self.methods_at(v)
+        result: dict[str, FunctionDef] = {}
+        paths = self.__method_lens_paths(g, t)
+        for method in methods_v:
+            lens = paths.get((v, method.name))
+            if lens is not None:
+                result[method.name] = lens
+        return result
+
+    def __replacement_method_lookup(
+        self, g: VersionGraph, m: str, v: VersionId
+    ) -> FunctionDef | None:
+        """
+        Search for a replacement implementation of method `m` for version `v`.
+        """
+        if m == "__init__":
+            return None
+        rm: set[FunctionDef] = set()
+        # TODO: Method conflicts here sibling version replacements
+        # gr = g.delete(v)
+        for r in g.replacements(v):
+            try:
+                me = self.method_lookup(g, m, r.name)
+                if me is not None:
+                    rm.add(me.implementation)
+            except MethodConflictException as e:
+                rm = rm.union(e.definitions)
+        if len(rm) == 0:
+            return None
+        if len(rm) == 1:
+            mv = get_at(list(rm)[0])
+            ge = g.delete(v).delete(mv)
+            try:
+                me = self.method_lookup(ge, m, v)
+                return rm.pop()
+            except MethodConflictException as e:
+                raise e
+
+        raise MethodConflictException(definitions=rm)
+
+    def __local_method_lookup(self, m: str, v: VersionId) -> FunctionDef | None:
+        """
+        Search for a local implementation of method `m` for version `v`.
+        """
+        methods = self.methods_at(v)
+        lm = list(me for me in methods if me.name == m)
+        if len(lm) == 0:
+            return None
+        if len(lm) == 1:
+            return lm[0]
+        raise MethodConflictException(definitions=set(lm))
+
+    def __inherited_method_lookup(
+        self, g: VersionGraph, m: str, v: VersionId
+    ) -> FunctionDef | None:
+        """
+        Search for an inherited implementation of method `m` for version `v`.
+        """
+        graph = g.delete(v)
+        um: set[FunctionDef] = set()
+        for p in g.parents(v):
+            try:
+                me = self.method_lookup(graph, m, p.name)
+                if me is not None:
+                    um.add(me.implementation)
+            except MethodConflictException as e:
+                um = um.union(e.definitions)
+        if len(um) == 0:
+            return None
+        if len(um) == 1:
+            return um.pop()
+        raise MethodConflictException(definitions=um)
+
+    def method_lookup(
+        self, g: VersionGraph, m: str, v: VersionId
+    ) -> VersionedMethod | None:
+        key = (graph_key(g), m, v)
+        if key not in self.__method_lookup:
+            try:
+                self.__method_lookup[key] = self.__method_lookup_uncached(g, m, v)
+            except MethodConflictException as e:
+                self.__method_lookup[key] = e
+        result = self.__method_lookup[key]
+        if isinstance(result, MethodConflictException):
+            raise result
+        return result
+
+    def __method_lookup_uncached(
+        self, g: VersionGraph, m: str, v: VersionId
+    ) -> VersionedMethod | None:
+        if g.find_version(v) is None:
+            return None
+        interface = implementation = None
+        # Start by looking for a local interface and implementation of `m`
+        lm = self.__local_method_lookup(m, v)
+        if lm is not None:
+            interface = lm
+            implementation = lm
+        # If none is found, look for interface and implementation in parent versions
+        else:
+            um = self.__inherited_method_lookup(g, m, v)
+            if um is not None:
+                interface = um
+                implementation = um
+        # Finally, look for an implementation in replacement versions.
+        try:
+            rm = self.__replacement_method_lookup(g, m, v)
+        # If there is a conflict in replacement versions, we still return the
+        # local/parent definition, if we found one already. This is so that methods
+        # defined @at(v) are still well typed. The conflict exception should be
+        # handled at some other point, when checking the soundness of the entire
+        # version graph against the class definition.
+        except MethodConflictException as e:
+            if implementation is None or interface is None:
+                raise e
+            rm = None
+        if rm is not None:
+            implementation = rm
+            # If no interface was found yet, this means that method `m` was
+            # introduced in a replacement version, so we set its interface to `rm`
+            if interface is None:
+                interface = rm
+
+        if interface is not None and implementation is not None:
+            return VersionedMethod(
+                name=m, interface=interface, implementation=implementation
+            )
+        else:
+            return None
+
+    def methods_at(self, v: VersionId) -> set[FunctionDef]:
+        """
+        Returns the methods of a class explicitly defined at version v.
+        """
+        return self.index.methods_at(v)
+
+    def fields_at(self, g: VersionGraph, v: VersionId) -> set[Field]:
+        """
+        Returns the set of fields explicitly defined at version v.
+        """
+        key = (graph_key(g), v)
+        if key not in self.__fields_at:
+            self.__lookup_version(g, v)
+        return self.__fields_at[key]
+
+    def __lookup_version(self, g: VersionGraph, v: VersionId) -> None:
+        """
+        Computes the facts of version `v` from the pass over `g`. Versions
+        that are not in `g` (e.g. after being deleted from it) get a step of
+        their own on top of that pass.
+        """
+        self.versions(g)
+        if (graph_key(g), v) not in self.__fields_at:
+            self.__version_step(g, graph_key(g), v)
+
+    def __assigned_fields(self, v: VersionId) -> dict[Field, bool]:
+        """
+        Returns the fields assigned by the methods explicitly defined at
+        version v (see `ClassFieldCollector`), from which all the fields of
+        the class are derived.
+        """
+        methods = self.methods_at(v)
+        visitor = ClassFieldCollector([m.name for m in methods], v)
+        for m in methods:
+            visitor.visit(m)
+        return visitor.fields
+
+    def __local_fields(self, v: VersionId, parent_fields: set[Field]) -> set[Field]:
+        """
+        Returns the fields introduced at version v, given the fields
+        explicitly defined at its parent versions.
+        """
+        result: set[Field] = set()
+        # Iterate over fields at v and check if they are inherited or introduced here.
+        for field, explicit in self.__assigned_fields(v).items():
+            if explicit:
+                result.add(field)
             else:
-                return result
-        return None
+                for pf in parent_fields:
+                    if field.name == pf.name:
+                        # Found an inherited field
+                        break
+                else:
+                    # If no inherited field was found we add it to the result
+                    result.add(field)
+        return result
 
 
-def __method_lens_path_lookup(
-    g: Graph, v: VersionId, t: VersionId, cls_ast: ClassDef, method: str
-) -> list[FunctionDef] | None:
-    # TODO: Do we need the method name in the result?
+def lens_attributes(lens: FunctionDef) -> set[tuple[str, str, type]]:
     """
-    Returns a list of lenses to rewrite method from version v to version t.
+    Returns the attributes of objects read or written by `lens`, with their
+    inferred types and contexts, which determine the fields it references.
     """
-    lenses = __method_lenses_at(g=g, cls_ast=cls_ast, v=v)
-    if method not in lenses:
-        return None
-    if t in lenses[method]:
-        return [lenses[method][t]]
-    else:
-        for w, lens in lenses[method].items():
-            result = [lens]
-            methods_w = methods_at(cls_ast, w)
-            for m in methods_w:
-                path = __method_lens_path_lookup(g.delete(v), w, t, cls_ast, m.name)
-                if path is None:
-                    break
-                result += path
-            else:
-                return result
-        return None
+    return {
+        (attr.attr, str(typeof_node(attr)), type(attr.ctx))
+        for attr in object_attributes(lens)
+    }
+
+
+# Lookups of the classes of each analyzed module, shared by every consumer of
+# the same tree. They are kept by module, since each lookup refers to its class.
+__module_lookups: WeakKeyDictionary[Module, dict[ClassDef, ClassLookup]] = (
+    WeakKeyDictionary()
+)
 
 
-def __field_lens_lookup(
-    g: Graph, v: VersionId, t: VersionId, cls_ast: ClassDef
-) -> dict[Field, FunctionDef | None]:
+def module_lookups(mod_ast: Module) -> dict[ClassDef, ClassLookup]:
     """
-    Returns the field lenses from v to t.
+    Returns the lookups of the classes of module `mod_ast`, by class. The
+    lookups memoize fields and field lens paths, which depend on inferred
+    types, so these must only be looked up once the module is annotated.
     """
-    fields_v = fields_lookup(g, cls_ast, v)
-    result: dict[Field, FunctionDef | None] = {}
-    bases_v = base_versions(g, cls_ast, v)
-    bases_t = base_versions(g, cls_ast, t)
-    for field in fields_v:
-        path = __field_lens_path_lookup(g, v, t, cls_ast, field.name)
-        if path is None:
-            if bases_v <= bases_t or field in fields_lookup(g, cls_ast, t):
-                result[field] = None
-        else:
-            result[field] = path[0]
-    return result
+    lookups = __module_lookups.setdefault(mod_ast, {})
+    for node in mod_ast.body:
+        if isinstance(node, ClassDef) and node not in lookups:
+            lookups[node] = ClassLookup(node)
+    return lookups
 
 
-def __method_lens_lookup(
-    g: Graph, v: VersionId, t: VersionId, cls_ast: ClassDef
-) -> dict[str, FunctionDef]:
+def class_lookup(cls_ast: ClassDef, mod_ast: Module | None = None) -> ClassLookup:
     """
-    Returns the method lenses from v to t.
+    Returns the lookup of class `cls_ast` among the lookups of module
+    `mod_ast` (see `module_lookups`), or a new lookup if `cls_ast` is not a
+    class of `mod_ast`.
     """
-    methods_v = methods_at(cls_ast, v)
-    result: dict[str, FunctionDef] = {}
-    for method in methods_v:
-        path = __method_lens_path_lookup(g, v, t, cls_ast, method.name)
-        if path is not None:
-            lens = path[0]
-            result[method.name] = lens
-    return result
-
-
-def __replacement_method_lookup(
-    g: Graph, cls_ast: ClassDef, m: str, v: VersionId
-) -> FunctionDef | None:
+    lookup = None if mod_ast is None else module_lookups(mod_ast).get(cls_ast)
+    return ClassLookup(cls_ast) if lookup is None else lookup
+
+
+def update_module_lookups(mod_ast: Module, old_mod: Module) -> None:
     """
-    Search for a replacement implementation of method `m` for version `v`.
+    Sets the lookups of the classes of module `mod_ast`, an edit of annotated
+    module `old_mod`, to updates of the lookups of the classes of the same
+    name in `old_mod` (see `ClassLookup.update`). Classes of `old_mod` that
+    were not looked up yet have nothing to keep.
     """
-    if m == "__init__":
-        return None
-    rm: set[FunctionDef] = set()
-    # TODO: Method conflicts here sibling version replacements
-    # gr = g.delete(v)
-    for r in g.replacements(v):
-        try:
-            me = _method_lookup(g, cls_ast, m, r.name)
-            if me is not None:
-                #     version_v = g.find_version(v)
-                #     if version_v is not None:
-                #         try:
-                #             if get_at(me.implementation) in [
-                #                 r for r in version_v.replaces
-                #             ] and (lm := __local_method_lookup(cls_ast=cls_ast, m=m, v=v)):
-                #                 return lm
-                #         except MethodConflictException:
-                #             continue
-                rm.add(me.implementation)
-        except MethodConflictException as e:
-            rm = rm.union(e.definitions)
-    if len(rm) == 0:
-        return None
-    if len(rm) == 1:
-        mv = get_at(list(rm)[0])
-        ge = g.delete(v).delete(mv)
-        try:
-            me = _method_lookup(ge, cls_ast, m, v)
-            return rm.pop()
-        except MethodConflictException as e:
-            raise e
+    old_lookups = {
+        lookup.cls_ast.name: lookup
+        for lookup in __module_lookups.get(old_mod, {}).values()
+    }
+    lookups: dict[ClassDef, ClassLookup] = {}
+    for node in mod_ast.body:
+        if isinstance(node, ClassDef):
+            old = old_lookups.get(node.name)
+            lookups[node] = ClassLookup(node) if old is None else old.update(node)
+    __module_lookups[mod_ast] = lookups
+
+
+def base_versions(g: VersionGraph, cls_ast: ClassDef, v: VersionId) -> set[VersionId]:
+    return ClassLookup(cls_ast).base_versions(g, v)
+
+
+def field_lenses_lookup(g: VersionGraph, cls_ast: ClassDef) -> Lenses:
+    return ClassLookup(cls_ast).field_lenses_lookup(g)
 
-    raise MethodConflictException(definitions=rm)
 
+def method_lenses_lookup(g: VersionGraph, cls_ast: ClassDef) -> Lenses:
+    return ClassLookup(cls_ast).method_lenses_lookup(g)
 
-def __local_method_lookup(
-    cls_ast: ClassDef, m: str, v: VersionId
-) -> FunctionDef | None:
+
+def fields_lookup(g: VersionGraph, cls_ast: ClassDef, v: VersionId) -> set[Field]:
     """
-    Search for a local implementation of method `m` for version `v`.
+    Returns the set of fields defined for version v.
+    These may be explictly defined at v or inherited from some other related version(s).
     """
-    methods = methods_at(cls_ast, v)
-    lm = list(me for me in methods if me.name == m)
-    if len(lm) == 0:
-        return None
-    if len(lm) == 1:
-        return lm[0]
-    raise MethodConflictException(definitions=set(lm))
-
-
-def __inherited_method_lookup(
-    g: Graph, cls_ast: ClassDef, m: str, v: VersionId
-) -> FunctionDef | None:
+    return ClassLookup(cls_ast).fields_lookup(g, v)
+
+
+def methods_lookup(
+    g: VersionGraph, cls_ast: ClassDef, v: VersionId, *, _except: bool = False
+) -> set[VersionedMethod]:
     """
-    Search for an inherited implementation of method `m` for version `v`.
+    Returns the methods of a class available at version v. These may be
+    explictly defined at v or inherited from some other related version(s).
     """
-    graph = g.delete(v)
-    um: set[FunctionDef] = set()
-    for p in g.parents(v):
-        try:
-            me = _method_lookup(graph, cls_ast, m, p.name)
-            if me is not None:
-                um.add(me.implementation)
-        except MethodConflictException as e:
-            um = um.union(e.definitions)
-    if len(um) == 0:
-        return None
-    if len(um) == 1:
-        return um.pop()
-    raise MethodConflictException(definitions=um)
+    return ClassLookup(cls_ast).methods_lookup(g, v, _except=_except)
 
 
 def _method_lookup(
-    g: Graph, cls_ast: ClassDef, m: str, v: VersionId
+    g: VersionGraph, cls_ast: ClassDef, m: str, v: VersionId
 ) -> VersionedMethod | None:
-    if g.find_version(v) is None:
-        return None
-    interface = implementation = None
-    # Start by looking for a local interface and implementation of `m`
-    lm = __local_method_lookup(cls_ast, m, v)
-    if lm is not None:
-        interface = lm
-        implementation = lm
-    # If none is found, look for interface and implementation in parent versions
-    else:
-        um = __inherited_method_lookup(g, cls_ast, m, v)
-        if um is not None:
-            interface = um
-            implementation = um
-    # Finally, look for an implementation in replacement versions.
-    try:
-        rm = __replacement_method_lookup(g, cls_ast, m, v)
-    # If there is a conflict in replacement versions, we still return the
-    # local/parent definition, if we found one already. This is so that methods
-    # defined @at(v) are still well typed. The conflict exception should be
-    # handled at some other point, when checking the soundness of the entire
-    # version graph against the class definition.
-    except MethodConflictException as e:
-        if implementation is None or interface is None:
-            raise e
-        rm = None
-    if rm is not None:
-        implementation = rm
-        # If no interface was found yet, this means that method `m` was
-        # introduced in a replacement version, so we set its interface to `rm`
-        if interface is None:
-            interface = rm
-
-    if interface is not None and implementation is not None:
-        return VersionedMethod(
-            name=m, interface=interface, implementation=implementation
-        )
-    else:
-        return None
+    return ClassLookup(cls_ast).method_lookup(g, m, v)
 
 
 def methods_at(cls_ast: ClassDef, v: VersionId) -> set[FunctionDef]:
     """
     Returns the methods of a class explicitly defined at version v.
     """
-
-    visitor = MethodCollector(v=v)
-    visitor.visit(cls_ast)
-    return visitor.methods
+    return ClassLookup(cls_ast).methods_at(v)
 
 
-def fields_at(g: Graph, cls_ast: ClassDef, v: VersionId) -> set[Field]:
+def fields_at(g: VersionGraph, cls_ast: ClassDef, v: VersionId) -> set[Field]:
     """
     Returns the set of fields explicitly defined at version v.
     """
-    methods = methods_at(cls_ast, v)
-    visitor = ClassFieldCollector([m.name for m in methods], v)
-    for m in methods:
-        visitor.visit(m)
-    parent_fields = {f for p in g.parents(v) for f in fields_at(g, cls_ast, p.name)}
-    result: set[Field] = set()
-    # Iterate over fields at v and check if they are inherited or introduced here.
-    for field, explicit in visitor.fields.items():
-        if explicit:
-            result.add(field)
-        else:
-            for pf in parent_fields:
-                if field.name == pf.name:
-                    # Found an inherited field
-                    break
-            else:
-                # If no inherited field was found we add it to the result
-                result.add(field)
-
-    return result
+    return ClassLookup(cls_ast).fields_at(g, v)
@@ -1,45 +1,85 @@
 import ast
 import inspect
-import importlib
-from typing import Any, Callable, Type
+from types import ModuleType
+from typing import Any, Callable, NamedTuple, Type
+from vpy.lib.cache import content_hash
 from vpy.lib.lib_types import VersionId
-from vpy.lib.slice import eval_slice
+from vpy.lib.slice import eval_module_slice
 from vpy.lib.transformers.decorators import RemoveDecoratorsTransformer
 
 
-def run[T, **P](
-    fun: Callable[P, T], v: VersionId, *args: P.args, **kwargs: P.kwargs
-) -> T:
-    # grab the module where fun is defined
-    mod = inspect.getmodule(fun)
-    if mod is None:
-        raise Exception("Module does not exist")
+class RuntimeSlice(NamedTuple):
+    """
+    Sliced classes of a module for a given version, together with the
+    functions that have already been rewritten to run against them.
+    """
+
+    classes: dict[str, Type[Any]]
+    functions: dict[str, Callable[..., Any]]
+
+
+# Slices built so far, keyed by (module file, content hash, version).
+__slices: dict[tuple[str, str, VersionId], RuntimeSlice] = {}
+
+
+def runtime_slice(mod: ModuleType, v: VersionId) -> RuntimeSlice:
+    """
+    Returns the slice of module `mod` for version `v`, building it only if
+    the module file changed since the last time it was sliced.
+    """
+    if mod.__file__ is None:
+        raise Exception("Module file does not exist")
+    key = (mod.__file__, content_hash(mod.__file__), v)
+    if key in __slices:
+        return __slices[key]
+    # Drop slices of outdated contents of this file.
+    for stale in [k for k in __slices if k[0] == key[0] and k[1] != key[1]]:
+        del __slices[stale]
     # slice all classes in module for version v
-    classes: dict[str, Type[Any]] = {}
-    for m in inspect.getmembers(mod, inspect.isclass):
-        if m[1].__module__ == mod.__name__:
-            classes[m[0]] = eval_slice(mod, getattr(mod, m[0]), v)
+    classes = eval_module_slice(mod, v)
+    __slices[key] = RuntimeSlice(classes=classes, functions={})
+    return __slices[key]
+
+
+def rewrite_function[T, **P](fun: Callable[P, T], sl: RuntimeSlice) -> Callable[P, T]:
+    """
+    Returns the function `fun` without its version decorators, compiled
+    against the globals of its module.
+    """
+    if fun.__qualname__ in sl.functions:
+        return sl.functions[fun.__qualname__]
     # rewrite function calls
     src = inspect.getsource(fun)
     f_ast = ast.parse(src)
     f_ast = RemoveDecoratorsTransformer().visit(f_ast)
 
-    # register new classes
-    globs = fun.__globals__
-    locs: dict[str, Callable[..., T]] = {}
-    for cls_name, cls in classes.items():
-        importlib.import_module(mod.__name__)
-        setattr(mod, f"{cls_name}", cls)
-
     # register new functions
+    globs = fun.__globals__
+    locs: dict[str, Callable[P, T]] = {}
     compiled_code = compile(f_ast, "<ast>", "exec")
     exec(compiled_code, globs, locs)
+    sl.functions[fun.__qualname__] = locs[fun.__name__]
+    return locs[fun.__name__]
 
-    # run wrapped function after rewrite
-    result: T = locs[fun.__name__](*args, **kwargs)
 
-    # teardown runtime
-    for cls_name, cls in classes.items():
-        importlib.import_module(mod.__name__)
-        delattr(mod, f"{cls_name}")
-    return result
+def run[T, **P](
+    fun: Callable[P, T], v: VersionId, *args: P.args, **kwargs: P.kwargs
+) -> T:
+    # grab the module where fun is defined
+    mod = inspect.getmodule(fun)
+    if mod is None:
+        raise Exception("Module does not exist")
+    sl = runtime_slice(mod, v)
+    rw_fun = rewrite_function(fun, sl)
+
+    # register new classes
+    originals = {name: getattr(mod, name) for name in sl.classes}
+    for cls_name, cls in sl.classes.items():
+        setattr(mod, cls_name, cls)
+    try:
+        # run wrapped function after rewrite
+        return rw_fun(*args, **kwargs)
+    finally:
+        # teardown runtime
+        for cls_name, cls in originals.items():
+            setattr(mod, cls_name, cls)
@@ -1,27 +1,110 @@
 import ast
+from ast import ClassDef, Module
 from types import ModuleType
-from typing import Type
+from typing import Any, Type
 
 
 from vpy.lib.lib_types import VersionId
-from vpy.lib.transformers.module import ModuleTransformer
-from vpy.lib.utils import parse_module
+from vpy.lib.transformers.module import ModuleStrictTransformer, ModuleTransformer
+from vpy.lib.lookup import module_lookups
+from vpy.lib.utils import (
+    deepcopy_node,
+    graph,
+    lazy_class_environment,
+    module_environment,
+    parse_module,
+)
 
 
-def eval_slice[T](module: ModuleType, cls: Type[T], v: VersionId) -> Type[T]:
+class SliceSession:
+    """
+    Analyzed module that can be sliced for any number of versions. The
+    transformers rewrite the classes they slice in place, so each slice works
+    on its own copy of the classes of the module, while the other statements
+    and the inferred types are shared with the analyzed module, which is left
+    untouched.
+    """
+
+    def __init__(self, file: str | None = None, *, tree: Module | None = None):
+        """
+        Analyzes the module in `file`, unless its annotated tree is given.
+        """
+        if tree is None:
+            assert file is not None
+            tree, _ = parse_module(file)
+        self.tree = tree
+        # Statements rewritten by the transformers, which must be copied.
+        self.__copied = [
+            i
+            for i, stmt in enumerate(tree.body)
+            if any(isinstance(node, ClassDef) for node in ast.walk(stmt))
+        ]
+        # Lookups on the classes of the module, shared by every slice.
+        lookups = module_lookups(tree)
+        self.__lookups = [
+            lookups[node] for node in tree.body if isinstance(node, ClassDef)
+        ]
+
+    def versions(self) -> set[VersionId]:
+        """
+        Returns the versions of the classes of the module.
+        """
+        return {
+            v.name
+            for node in self.tree.body
+            if isinstance(node, ClassDef)
+            for v in graph(node).all()
+        }
+
+    def slice(self, v: VersionId, *, strict: bool = False) -> Module:
+        """
+        Returns a new module with the slice of version `v`.
+        """
+        body = list(self.tree.body)
+        for i in self.__copied:
+            body[i] = deepcopy_node(body[i])
+        mod = Module(body=body, type_ignores=self.tree.type_ignores)
+        if strict:
+            return ModuleStrictTransformer(v).visit(mod)
+        # Slicing adds put lenses to the environment, so each slice gets its own
+        # environment, bound to its copy of the classes. Its methods and lenses
+        # are only looked up as the slice needs them.
+        classes = [node for node in mod.body if isinstance(node, ClassDef)]
+        envs = [
+            lazy_class_environment(lookup.cls_ast, node, lookup=lookup)
+            for node, lookup in zip(classes, self.__lookups)
+        ]
+        env = module_environment(classes, envs)
+        return ModuleTransformer(v, env=env).visit(mod)
+
+    def code(self, v: VersionId, *, strict: bool = False) -> str:
+        """
+        Returns the code of the slice of version `v`.
+        """
+        return ast.unparse(ast.fix_missing_locations(self.slice(v, strict=strict)))
+
+
+def eval_module_slice(module: ModuleType, v: VersionId) -> dict[str, Type[Any]]:
+    """
+    Returns every class of `module` sliced for version `v`. The module is
+    analyzed and transformed once, and all sliced classes are evaluated
+    together in a copy of the module namespace, so that references between
+    them resolve to their sliced counterparts.
+    """
     if module.__file__ is None:
         assert False, "Error parsing module file"
-    mod_ast, _ = parse_module(module.__file__)
-    sl_mod = ModuleTransformer(v).visit(mod_ast)
+    sl_mod = SliceSession(module.__file__).slice(v)
+    sl_classes = [c for c in sl_mod.body if isinstance(c, ast.ClassDef)]
+    s = ast.unparse(
+        ast.fix_missing_locations(ast.Module(body=sl_classes, type_ignores=[]))
+    )
+    namespace = dict(module.__dict__)
+    exec(compile(s, "<ast>", "exec"), namespace)
+    return {c.name: namespace[c.name] for c in sl_classes}
+
+
+def eval_slice[T](module: ModuleType, cls: Type[T], v: VersionId) -> Type[T]:
     try:
-        sl_cls = next(
-            c
-            for c in sl_mod.body
-            if isinstance(c, ast.ClassDef) and c.name == f"{cls.__name__}"
-        )
-    except StopIteration:
+        return eval_module_slice(module, v)[cls.__name__]
+    except KeyError:
         assert False
-    s = ast.unparse(ast.fix_missing_locations(sl_cls))
-    out: list[Type[T]] = [cls]
-    exec(s + f"\nout[0]={cls.__name__}")
-    return out[0]
@@ -13,7 +13,6 @@ from ast import (
     keyword,
 )
 from typing import Any
-import copy
 from vpy.lib.transformers.lens import PutLens
 from vpy.lib.lib_types import (
     Environment,
@@ -24,6 +23,8 @@ from vpy.lib.lib_types import (
 )
 from vpy.lib.utils import (
     annotation_from_type_value,
+    copy_node,
+    deepcopy_node,
     fields_in_function,
     fresh_var,
     get_at,
@@ -105,12 +106,14 @@ class AssignTransformer(ast.NodeTransformer):
         env: Environment,
         v_target: VersionId,
         v_from: VersionId,
+        names: set[str],
     ):
         self.g = g
         self.cls_ast = cls_ast
         self.env = env
         self.v_target = v_target
         self.v_from = v_from
+        self.names = names
 
     def step_rw_assign(
         self, target: Attribute, value: ast.expr, lens_ver
@@ -122,6 +125,7 @@ class AssignTransformer(ast.NodeTransformer):
             env=self.env,
             v_target=lens_ver,
             v_from=self.v_from,
+            names=self.names,
         )
         rw_exprs = visitor.__rw_assign(target, value)
         visitor.v_from = lens_ver
@@ -183,7 +187,7 @@ class AssignTransformer(ast.NodeTransformer):
                 references = fields_in_function(
                     lens_node, self.env.fields[obj_type][self.v_from]
                 )
-                for ref in references:
+                for ref in sorted(references, key=lambda f: f.name):
                     if ref.name != lhs.attr:
                         attr = create_obj_attr(
                             obj=lhs.value,
@@ -207,7 +211,7 @@ class AssignTransformer(ast.NodeTransformer):
                 ):
                     put_lens = PutLens(
                         fields=self.env.fields[obj_type][self.v_from]
-                    ).visit(copy.deepcopy(lens_node))
+                    ).visit(deepcopy_node(lens_node))
                     self.env.put_lenses[obj_type].add_lens(
                         v_from=self.v_from,
                         attr=field,
@@ -244,7 +248,7 @@ class AssignTransformer(ast.NodeTransformer):
         if len(ref_visitor.references) == 0:
             return node
         else:
-            left_node = copy.deepcopy(node.target)
+            left_node = deepcopy_node(node.target)
             left_node.ctx = ast.Load()
             assign = Assign(
                 targets=[node.target],
@@ -286,7 +290,7 @@ class AssignTransformer(ast.NodeTransformer):
             # As such, we need to introduce a new local variable holding the assignment value whenever
             # we have multiple targets, or a single tuple target.
             if len(node.targets) > 1 or isinstance(node.targets[0], Tuple):
-                local_var = Name(id=fresh_var(), ctx=ast.Store())
+                local_var = Name(id=fresh_var(self.names), ctx=ast.Store())
                 set_typeof_node(local_var, typeof_node(node.value))
                 local_assign = Assign(targets=[local_var], value=node.value)
                 exprs.append(local_assign)
@@ -309,11 +313,11 @@ class AssignTransformer(ast.NodeTransformer):
                 # and use it as the target.
                 elif isinstance(target, Subscript):
                     for ref in references:
-                        local_var = Name(id=fresh_var(), ctx=ast.Store())
+                        local_var = Name(id=fresh_var(self.names), ctx=ast.Store())
                         set_typeof_node(local_var, typeof_node(ref))
                         local_assign = Assign(targets=[local_var], value=ref)
                         exprs.append(local_assign)
-                        node_copy = copy.copy(target)
+                        node_copy = copy_node(target)
                         node_copy.value = local_var
                         local_assign = Assign(targets=[node_copy], value=node.value)
                         exprs.append(local_assign)
@@ -330,7 +334,7 @@ class AssignTransformer(ast.NodeTransformer):
                         else:
                             exprs.append(Assign(targets=[el], value=val))
                 else:
-                    node_copy = copy.copy(node)
+                    node_copy = copy_node(node)
                     node_copy.targets = [target]
                     exprs.append(node_copy)
         else:
@@ -14,6 +14,7 @@ from vpy.lib.utils import (
     get_at,
     graph,
     is_lens,
+    used_names,
 )
 from vpy.lib.visitors.alias import AliasVisitor
 
@@ -83,6 +84,10 @@ class MethodTransformer(NodeTransformer):
             alias_visitor = AliasVisitor(
                 g=self.g, cls_ast=self.cls_ast, env=self.env, v_from=v_from
             )
+            # Local variables introduced by the rewrite, fresh in this method.
+            names = used_names(node)
+            # Aliases are collected statement by statement as fields are
+            # extracted to local variables, in a single traversal.
             fields_var = ExtractLocalVar(
                 g=self.g,
                 cls_ast=self.cls_ast,
@@ -90,6 +95,8 @@ class MethodTransformer(NodeTransformer):
                 v_from=v_from,
                 v_target=self.v_target,
                 aliases=alias_visitor.aliases,
+                names=names,
+                collect_aliases=alias_visitor.visit,
             )
             assign_rw = AssignTransformer(
                 self.g,
@@ -97,8 +104,8 @@ class MethodTransformer(NodeTransformer):
                 self.env,
                 self.v_target,
                 v_from,
+                names=names,
             )
-            alias_visitor.visit(node)
             fields_var.visit(node)
             assign_rw.generic_visit(node)
             fields_rw = FieldTransformer(
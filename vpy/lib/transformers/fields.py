@@ -1,10 +1,10 @@
 import ast
-import copy
 from ast import Attribute, Call, ClassDef
 
 from vpy.lib.lib_types import Environment, Graph, VersionId
 from vpy.lib.utils import (
     annotation_from_type_value,
+    deepcopy_node,
     get_at,
     create_obj_attr,
     has_get_lens,
@@ -68,7 +68,7 @@ class FieldTransformer(ast.NodeTransformer):
             if not has_get_lens(self.cls_ast, lens_node):
                 from vpy.lib.transformers.cls import MethodTransformer
 
-                lens_node_copy = copy.deepcopy(lens_node)
+                lens_node_copy = deepcopy_node(lens_node)
                 if get_at(lens_node_copy) != self.v_target:
                     visitor = MethodTransformer(
                         g=self.g,
@@ -26,7 +26,7 @@ class PutLens(ast.NodeTransformer):
 
     def visit_FunctionDef(self, node):
         references = fields_in_function(node, self.fields)
-        for field in references:
+        for field in sorted(references, key=lambda f: f.name):
             node.args.kwonlyargs.append(field_to_arg(field))
             node.args.kw_defaults.append(None)
         # Replace the `get` decorator with `put`
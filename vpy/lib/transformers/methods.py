@@ -10,15 +10,16 @@ from ast import (
     Return,
     keyword,
 )
-from copy import copy, deepcopy
 
 from vpy.lib.lib_types import Environment, Graph, VersionId
 from vpy.lib.transformers.rewrite import RewriteName
 from vpy.lib.utils import (
     annotation_from_type_value,
+    copy_node,
     create_obj_attr,
     get_at,
     is_lens,
+    set_typeof_node,
     typeof_node,
 )
 
@@ -63,7 +64,7 @@ class MethodLensTransformer(ast.NodeTransformer):
                 self.visit(expr)
             return node
         if mdef.interface not in self.cls_ast.body:
-            mdef_copy = copy(mdef.interface)
+            mdef_copy = copy_node(mdef.interface)
             self_attr = create_obj_attr(
                 obj=Name(id="self", ctx=Load()),
                 attr=method_lens.node.name,
@@ -78,7 +79,7 @@ class MethodLensTransformer(ast.NodeTransformer):
             mdef_copy.body = [Return(value=ret_expr)]
             self.cls_ast.body.append(mdef_copy)
 
-        node_copy = copy(node)
+        node_copy = copy_node(node)
         node_copy.name = f"__{self.v_from}__" + node.name
         while method_lens is not None and method_lens.node is not None:
             if not hasattr(method_lens.node, "added"):
@@ -135,7 +136,7 @@ class MethodLensTransformer(ast.NodeTransformer):
                     )
                     if method_lens and method_lens.node:
                         node.func = Name(id=method_lens.node.name, ctx=Load())
-                        node.func.inferred_value = method_lens.node.inferred_value
+                        set_typeof_node(node.func, typeof_node(method_lens.node))
 
         # Rewrite object method call (`obj.m(...)`) using its corresponding lens.
         # This is required whenever the definition of `m` at version `v_from` is
@@ -143,15 +144,8 @@ class MethodLensTransformer(ast.NodeTransformer):
         if isinstance(node.func, Attribute):
             obj_type = annotation_from_type_value(typeof_node(node.func.value))
             if obj_type in self.env.method_lenses:
-                lenses = self.env.get_lenses[obj_type]
                 # Make sure that we are not rewriting a lens call.
-                if node.func.attr not in [
-                    l.node.name
-                    for t in lenses.values()
-                    for w in t.values()
-                    for l in w.values()
-                    if l.node is not None
-                ]:
+                if node.func.attr not in self.env.lens_names[obj_type]:
                     method_v_from = next(
                         m.implementation
                         for m in self.env.methods[obj_type][self.v_from]
@@ -3,9 +3,9 @@ from ast import ClassDef, Module
 from collections import defaultdict
 
 from vpy.lib import lookup
-from vpy.lib.lib_types import Environment, Lenses, VersionId
+from vpy.lib.lib_types import Environment, VersionId
 from vpy.lib.transformers.cls import ClassStrictTransformer, ClassTransformer
-from vpy.lib.utils import get_module_environment, graph
+from vpy.lib.utils import graph
 
 
 class ModuleStrictTransformer(ast.NodeTransformer):
@@ -23,13 +23,18 @@ class ModuleStrictTransformer(ast.NodeTransformer):
 
 class ModuleTransformer(ast.NodeTransformer):
     """
-    Project a version of this module.
+    Project a version of this module. Without an environment, the module is
+    left untouched and a sliced copy is returned (see `SliceSession`).
     """
 
-    def __init__(self, v: VersionId):
+    def __init__(self, v: VersionId, env: Environment | None = None):
         self.v = v
+        self.env = env
 
     def visit_Module(self, node: Module):
-        env = get_module_environment(node)
-        node = ClassTransformer(v=self.v, env=env).visit(node)
+        if self.env is None:
+            from vpy.lib.slice import SliceSession
+
+            return SliceSession(tree=node).slice(self.v)
+        node = ClassTransformer(v=self.v, env=self.env).visit(node)
         return node
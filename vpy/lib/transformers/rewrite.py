@@ -1,5 +1,4 @@
 import ast
-import copy
 from ast import (
     AST,
     AnnAssign,
@@ -31,11 +30,12 @@ from ast import (
     stmt,
     walk,
 )
-from typing import Any
+from typing import Any, Callable
 
 from vpy.lib.lib_types import Environment, Graph, VersionId
 from vpy.lib.utils import (
     annotation_from_type_value,
+    deepcopy_node,
     fresh_var,
     is_field,
     set_typeof_node,
@@ -50,7 +50,7 @@ class RewriteName(ast.NodeTransformer):
 
     def visit_Attribute(self, node):
         if node == self.src:
-            name = copy.deepcopy(self.target)
+            name = deepcopy_node(self.target)
             set_typeof_node(name, typeof_node(node))
             node = name
         self.generic_visit(node)
@@ -58,7 +58,7 @@ class RewriteName(ast.NodeTransformer):
 
     def visit_Name(self, node):
         if isinstance(self.src, Name) and node.id == self.src.id:
-            name = copy.deepcopy(self.target)
+            name = deepcopy_node(self.target)
             set_typeof_node(name, typeof_node(node))
             node = name
         return node
@@ -73,13 +73,23 @@ class ExtractLocalVar(ast.NodeTransformer):
         aliases: dict[expr, Attribute],
         v_from: VersionId,
         v_target: VersionId,
+        names: set[str],
+        collect_aliases: Callable[[stmt], Any] | None = None,
     ):
+        """
+        If given, `collect_aliases` is called on each statement of the method
+        before the statement is rewritten, to fill `aliases` in the same
+        traversal. The aliases of a statement only depend on the statements
+        before it.
+        """
         self.g = g
         self.cls_ast = cls_ast
         self.env = env
         self.v_target = v_target
         self.v_from = v_from
         self.aliases = aliases
+        self.names = names
+        self.collect_aliases = collect_aliases
 
     def visit_Assign(self, node: Assign) -> Any:
         expr_before = []
@@ -128,7 +138,7 @@ class ExtractLocalVar(ast.NodeTransformer):
         value_field_visitor = FieldReplacementVisitor(self)
         value_field_visitor.visit(node.value)
         if value_field_visitor.fields:
-            left_node = copy.deepcopy(node.target)
+            left_node = deepcopy_node(node.target)
             left_node.ctx = ast.Load()
             assign = Assign(
                 targets=[node.target],
@@ -159,7 +169,7 @@ class ExtractLocalVar(ast.NodeTransformer):
             rw_visitor = RewriteName(attr, var)
             node.iter = rw_visitor.visit(node.iter)
         if assign_visitor.assignments:
-            var = Name(fresh_var(), ctx=Store())
+            var = Name(fresh_var(self.names), ctx=Store())
             expr_before.append(Assign(targets=[var], value=node.iter))
             node.iter = var
         for idx, assign in enumerate(assign_visitor.assignments):
@@ -194,7 +204,7 @@ class ExtractLocalVar(ast.NodeTransformer):
             visitor = RewriteName(attr, var)
             node.test = visitor.visit(node.test)
         if assign_visitor.assignments:
-            var = Name(fresh_var(), ctx=Store())
+            var = Name(fresh_var(self.names), ctx=Store())
             expr_before.append(Assign(targets=[var], value=node.test))
             node.test = var
         for idx, assign in enumerate(assign_visitor.assignments):
@@ -276,7 +286,7 @@ class ExtractLocalVar(ast.NodeTransformer):
             visitor = RewriteName(attr, var)
             node.test = visitor.visit(node.test)
         if assign_visitor.assignments:
-            var = Name(fresh_var(), ctx=Store())
+            var = Name(fresh_var(self.names), ctx=Store())
             expr_before.append(Assign(targets=[var], value=node.test))
             node.test = var
         for idx, assign in enumerate(assign_visitor.assignments):
@@ -291,11 +301,17 @@ class ExtractLocalVar(ast.NodeTransformer):
     def visit_FunctionDef(self, node):
         # v = FieldReplacementVisitor(self)
         # v.generic_visit(node)
-        node = replace_in_body(node, "body", self)
+        node = replace_in_body(node, "body", self, before=self.collect_aliases)
         return node
 
 
-def replace_in_body(node, key: str, visitor: ExtractLocalVar, r: dict | None = None):
+def replace_in_body(
+    node,
+    key: str,
+    visitor: ExtractLocalVar,
+    r: dict | None = None,
+    before: Callable[[stmt], Any] | None = None,
+):
     idx = 0
     stmts = list(getattr(node, key))
     # for i, (attr, var) in enumerate(r.items()):
@@ -306,6 +322,8 @@ def replace_in_body(node, key: str, visitor: ExtractLocalVar, r: dict | None = N
     #     getattr(node, key)[idx + 1] = rw_visitor.generic_visit(getattr(node, key))
 
     for expr in stmts:
+        if before is not None:
+            before(expr)
         if isinstance(expr, Expr):
             field_visitor = FieldReplacementVisitor(visitor)
             field_visitor.visit(expr)
@@ -470,7 +488,7 @@ class AssignAfterCall(NodeVisitor):
 
 
 class FieldReplacementVisitor(NodeVisitor):
-    def __init__(self, visitor: ExtractLocalVar | AssignAfterCall):
+    def __init__(self, visitor: ExtractLocalVar):
         self.fields: dict[Attribute, Name] = {}
         self.visitor = visitor
 
@@ -497,7 +515,11 @@ class FieldReplacementVisitor(NodeVisitor):
                         if self.visitor.aliases[node] in self.fields:
                             self.fields[node] = self.fields[self.visitor.aliases[node]]
                         else:
-                            self.fields[node] = Name(id=fresh_var(), ctx=Load())
+                            self.fields[node] = Name(
+                                id=fresh_var(self.visitor.names), ctx=Load()
+                            )
                     else:
-                        self.fields[node] = Name(id=fresh_var(), ctx=Load())
+                        self.fields[node] = Name(
+                            id=fresh_var(self.visitor.names), ctx=Load()
+                        )
         self.generic_visit(node)
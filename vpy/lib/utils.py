@@ -13,9 +13,11 @@ from ast import (
     expr,
 )
 import ast
-from functools import cache
+import copy
+from functools import lru_cache
 from types import ModuleType
-from typing import TYPE_CHECKING, Protocol, Type, runtime_checkable
+from weakref import WeakKeyDictionary
+from typing import TYPE_CHECKING, Any, Callable, Type
 
 from vpy.typechecker.pyanalyze.value import (
     AnySource,
@@ -26,17 +28,63 @@ from vpy.typechecker.pyanalyze.value import (
 )
 
 if TYPE_CHECKING:
+    from vpy.lib.lookup import ClassLookup
     from vpy.typechecker.pyanalyze.name_check_visitor import NameCheckVisitor
 from vpy.lib.lib_types import (
     ClassEnvironment,
     Environment,
     Field,
+    FieldReference,
     Graph,
+    LazyLenses,
+    LazyTable,
+    Lens,
     Lenses,
-    Version,
+    VersionGraph,
+    VersionedMethod,
     VersionId,
+    graph,
 )
-import uuid
+
+# Attributes of objects in each annotated function, indexed the first time
+# the fields of the function are queried (see `object_attributes`).
+__object_attributes: WeakKeyDictionary[ast.AST, list[Attribute]] = WeakKeyDictionary()
+
+
+def object_attributes(node: ast.AST) -> list[Attribute]:
+    """
+    Returns the attributes of objects loaded, stored or deleted in function
+    `node`. They are collected in a single walk and shared by every query on
+    the fields of the function, so the function must not be rewritten after
+    being queried (transformers rewrite their own copies). Objects are told
+    apart by their inferred types, so the attributes are only shared once
+    the function has been annotated.
+    """
+    from vpy.lib.visitors.fields import ObjectAttributeCollector
+
+    if node in __object_attributes:
+        return __object_attributes[node]
+    visitor = ObjectAttributeCollector()
+    visitor.visit(node)
+    if node in __inferred_types:
+        __object_attributes[node] = visitor.attributes
+    return visitor.attributes
+
+
+def field_references(node: ast.AST, fields: set[Field]) -> set[FieldReference]:
+    """
+    Returns the references to `fields` in function `node`.
+    """
+    names = {field.name for field in fields}
+    return {
+        FieldReference(
+            field=Field(name=attr.attr, type=typeof_node(attr).simplify()),
+            node=attr,
+            ref_node=attr,
+        )
+        for attr in object_attributes(node)
+        if attr.attr in names
+    }
 
 
 def fields_in_function(
@@ -45,18 +93,36 @@ def fields_in_function(
     *,
     ctx=(Load, Store, Del),
 ) -> set[Field]:
-    from vpy.lib.visitors.fields import FieldReferenceCollector
+    names = {field.name for field in fields}
+    return {
+        Field(name=attr.attr, type=typeof_node(attr).simplify())
+        for attr in object_attributes(node)
+        if attr.attr in names and type(attr.ctx) in ctx
+    }
 
-    visitor = FieldReferenceCollector(fields, ctx=ctx)
-    visitor.visit(node)
-    return visitor.references
 
+def used_names(node: ast.AST) -> set[str]:
+    """
+    Returns the variable and parameter names used in `node`.
+    """
+    return {
+        n.id if isinstance(n, Name) else n.arg
+        for n in ast.walk(node)
+        if isinstance(n, (Name, ast.arg))
+    }
 
-def fresh_var() -> str:
+
+def fresh_var(names: set[str]) -> str:
     """
-    Returns a fresh unused variable name.
+    Returns the first variable name of the form `_<n>` that is not in `names`,
+    the names used in the function being rewritten, and adds it to them. Names
+    only depend on the function, so slicing the same input gives the same code.
     """
-    return f"_{str(uuid.uuid4().hex)}"
+    i = 0
+    while f"_{i}" in names:
+        i += 1
+    names.add(f"_{i}")
+    return f"_{i}"
 
 
 def is_field(node: Attribute, fields: set[Field] | None) -> bool:
@@ -65,19 +131,58 @@ def is_field(node: Attribute, fields: set[Field] | None) -> bool:
     return is_obj_attribute(node) and any(field.name == node.attr for field in fields)
 
 
-def typeof_node(node: ast.AST) -> Value:
-    @runtime_checkable
-    class Typed(Protocol):
-        inferred_value: Value
+# Type of the nodes that are not annotated.
+__any_type = AnyValue(AnySource.default)
 
-    if isinstance(node, Typed):
-        return node.inferred_value
+# Types inferred for the nodes of the analyzed trees, which live as long as
+# their nodes (see `store_inferred_types`).
+__inferred_types: WeakKeyDictionary[ast.AST, Value] = WeakKeyDictionary()
+
+
+def typeof_node(node: ast.AST) -> Value:
+    """
+    Returns the type inferred for `node`.
+    """
     # TODO: Check if this makes sense (this happens before NameCheckVisitor annotates the AST)
-    return AnyValue(AnySource.default)
+    return __inferred_types.get(node, __any_type)
 
 
 def set_typeof_node(node: ast.AST, type_value: Value) -> None:
-    setattr(node, "inferred_value", type_value)
+    __inferred_types[node] = type_value
+
+
+def store_inferred_types(tree: ast.AST) -> None:
+    """
+    Moves the types inferred by the annotator, which sets them as
+    `inferred_value` attributes, from the nodes of `tree` to the table read
+    by `typeof_node`.
+    """
+    for node in ast.walk(tree):
+        type_value = node.__dict__.pop("inferred_value", None)
+        if type_value is not None:
+            __inferred_types[node] = type_value
+
+
+def copy_node[N: ast.AST](node: N) -> N:
+    """
+    Returns a shallow copy of `node`, with the type inferred for `node`.
+    """
+    node_copy = copy.copy(node)
+    if node in __inferred_types:
+        __inferred_types[node_copy] = __inferred_types[node]
+    return node_copy
+
+
+def deepcopy_node[N: ast.AST](node: N) -> N:
+    """
+    Returns a deep copy of `node`, whose nodes have the types inferred for
+    the nodes they copy.
+    """
+    node_copy = copy.deepcopy(node)
+    for orig, new in zip(ast.walk(node), ast.walk(node_copy)):
+        if orig in __inferred_types:
+            __inferred_types[new] = __inferred_types[orig]
+    return node_copy
 
 
 def create_obj_attr(
@@ -141,69 +246,349 @@ def is_obj_attribute(node: Attribute, obj_type: str | None = None) -> bool:
     return False
 
 
-@cache
-def graph(cls: ClassDef) -> Graph:
-    """
-    Build a version graph for class `cls`.
-    """
-    return Graph(
-        graph=[
-            Version(d.keywords)
-            for d in cls.decorator_list
-            if isinstance(d, Call)
-            and isinstance(d.func, Name)
-            and d.func.id == "version"
-        ]
-    )
+# Environments of analyzed classes and modules, shared by every consumer of the
+# same tree.
+__class_environments: WeakKeyDictionary[ClassDef, ClassEnvironment] = (
+    WeakKeyDictionary()
+)
+__module_environments: WeakKeyDictionary[Module, Environment] = WeakKeyDictionary()
 
+# Number of worker processes that build the class environments of a module
+# (see `get_module_environment`). If None, one per available CPU is used.
+environment_jobs: int | None = 1
 
-def get_class_environment(cls_ast: ClassDef):
-    from vpy.lib.lookup import (
-        field_lenses_lookup,
-        method_lenses_lookup,
-        methods_lookup,
-        base_versions,
-        fields_lookup,
-    )
+# Classes whose environments are being built, with their lookups by position,
+# inherited by the workers on fork.
+__environment_classes: tuple[list[ClassDef], bool, dict[int, "ClassLookup"]] | None = (
+    None
+)
+
+
+def get_class_environment(
+    cls_ast: ClassDef, *, lenses: bool = True, lookup: "ClassLookup | None" = None
+):
+    """
+    Returns the environment of class `cls_ast`. Complete environments are
+    built once per tree and shared, so they must only be requested after the
+    tree is annotated. If `lenses` is false, the lens lookups are skipped,
+    the lens tables are left empty and the environment is not shared. The
+    lookups are memoized in `lookup`, if given.
+    """
+    from vpy.lib.lookup import ClassLookup
 
+    if lenses and cls_ast in __class_environments:
+        return __class_environments[cls_ast]
     env = ClassEnvironment()
     g = graph(cls_ast)
-    env.get_lenses = field_lenses_lookup(g, cls_ast)
+    if lookup is None:
+        lookup = ClassLookup(cls_ast)
+    if lenses:
+        env.get_lenses = lookup.field_lenses_lookup(g)
+        env.method_lenses = lookup.method_lenses_lookup(g)
     env.put_lenses = Lenses()
-    env.method_lenses = method_lenses_lookup(g, cls_ast)
     env.versions = g
-    for k in g.all():
+    env.lens_names = lookup.index.lens_names
+    for k in lookup.versions(g):
         env.methods[k.name] = {  # type: ignore
             m  # type: ignore
-            for m in methods_lookup(g, cls_ast, k.name)
+            for m in lookup.methods_lookup(g, k.name)
             # if isinstance(m, VersionedMethod) or m[0].name not in dir(object)
         }
-        env.bases[k.name] = base_versions(g, cls_ast, k.name)
-        env.fields[k.name] = fields_lookup(g, cls_ast, k.name)
+        env.bases[k.name] = lookup.base_versions(g, k.name)
+        env.fields[k.name] = lookup.fields_lookup(g, k.name)
+    if lenses:
+        __class_environments[cls_ast] = env
+    return env
+
+
+def lazy_class_environment(
+    cls_ast: ClassDef,
+    copy: ClassDef | None = None,
+    *,
+    lookup: "ClassLookup | None" = None,
+) -> ClassEnvironment:
+    """
+    Returns the environment of class `cls_ast` where the methods of each
+    version and the lenses out of each version are only looked up when they
+    are first needed, which spares slicing for a single version the lookups
+    between every pair of versions. If `copy`, a copy of `cls_ast` made
+    before any change to either, is given, the environment refers to its
+    definitions instead, so that `copy` can be sliced while lookups keep
+    working on the untouched `cls_ast`. The lookups made for the environment
+    are memoized in `lookup`, which can be shared by several environments of
+    the class. The environment itself is not shared.
+    """
+    from vpy.lib.lookup import ClassLookup
+
+    g = graph(cls_ast)
+    if lookup is None:
+        lookup = ClassLookup(cls_ast)
+    if copy is None:
+        nodes = None
+    else:
+        nodes = {id(n): c for n, c in zip(ast.walk(cls_ast), ast.walk(copy))}
+
+    def node(n: FunctionDef) -> FunctionDef:
+        return n if nodes is None else nodes[id(n)]
+
+    def lenses_from(lenses: Callable[[VersionGraph, VersionId], Any]):
+        def lenses_from_v(v: VersionId) -> LazyTable[dict[str, Lens]]:
+            row = lenses(g, v)
+            if nodes is None:
+                return row
+            return LazyTable(
+                row.versions,
+                lambda v_to: {
+                    attr: Lens(
+                        v_from=lens.v_from,
+                        v_target=lens.v_target,
+                        attr=lens.attr,
+                        node=None if lens.node is None else node(lens.node),
+                    )
+                    for attr, lens in row[v_to].items()
+                },
+            )
+
+        return lenses_from_v
+
+    env = ClassEnvironment()
+    env.get_lenses = LazyLenses(g.names, lenses_from(lookup.field_lenses_from))
+    env.method_lenses = LazyLenses(g.names, lenses_from(lookup.method_lenses_from))
+    env.put_lenses = Lenses()
+    env.versions = g
+    env.lens_names = lookup.index.lens_names
+    env.methods = LazyTable(
+        g.names,
+        lambda v: {
+            VersionedMethod(m.name, node(m.interface), node(m.implementation))
+            for m in lookup.methods_lookup(g, v)
+        },
+    )
+    for k in lookup.versions(g):
+        env.bases[k.name] = lookup.base_versions(g, k.name)
+        env.fields[k.name] = lookup.fields_lookup(g, k.name)
     return env
 
 
-def get_module_environment(mod_ast: Module):
+def pack_class_environment(cls_ast: ClassDef, env: ClassEnvironment) -> Any:
+    """
+    Returns a picklable representation of environment `env` of class
+    `cls_ast`, where each method and lens is replaced by its position in the
+    class tree. The version graph is left out, as it is rebuilt from the tree.
+    """
+    index = {id(node): i for i, node in enumerate(ast.walk(cls_ast))}
+
+    def pack_lenses(lenses: Lenses):
+        return {
+            v_from: {
+                v_to: {
+                    attr: (
+                        lens.v_target,
+                        None if lens.node is None else index[id(lens.node)],
+                    )
+                    for attr, lens in attrs.items()
+                }
+                for v_to, attrs in targets.items()
+            }
+            for v_from, targets in lenses.items()
+        }
+
+    return (
+        env.bases,
+        env.fields,
+        {
+            v: {
+                (m.name, index[id(m.interface)], index[id(m.implementation)])
+                for m in methods
+            }
+            for v, methods in env.methods.items()
+        },
+        pack_lenses(env.get_lenses),
+        pack_lenses(env.put_lenses),
+        pack_lenses(env.method_lenses),
+    )
+
+
+def unpack_class_environment(cls_ast: ClassDef, packed: Any) -> ClassEnvironment:
+    """
+    Returns the environment of class `cls_ast` from its representation
+    `packed` (see `pack_class_environment`).
+    """
+    from vpy.lib.lookup import decorator_index
+
+    nodes = list(ast.walk(cls_ast))
+    bases, fields, methods, get_lenses, put_lenses, method_lenses = packed
+
+    def unpack_lenses(packed_lenses) -> Lenses:
+        lenses = Lenses()
+        for v_from, targets in packed_lenses.items():
+            lenses[v_from] = {
+                v_to: {
+                    attr: Lens(
+                        v_from=v_from,
+                        v_target=v_target,
+                        attr=attr,
+                        node=None if i is None else nodes[i],
+                    )
+                    for attr, (v_target, i) in attrs.items()
+                }
+                for v_to, attrs in targets.items()
+            }
+        return lenses
+
+    return ClassEnvironment(
+        bases=bases,
+        fields=fields,
+        methods={
+            v: {
+                VersionedMethod(name, nodes[interface], nodes[implementation])
+                for name, interface, implementation in v_methods
+            }
+            for v, v_methods in methods.items()
+        },
+        get_lenses=unpack_lenses(get_lenses),
+        put_lenses=unpack_lenses(put_lenses),
+        method_lenses=unpack_lenses(method_lenses),
+        versions=graph(cls_ast),
+        lens_names=decorator_index(cls_ast).lens_names,
+    )
+
+
+def __pack_environment_of(i: int) -> Any:
+    """
+    Builds and packs the environment of the `i`-th class being built. Returns
+    None if it cannot be sent back, e.g. because the inferred type of a field
+    cannot be pickled, so that it is built again by the parent process.
+    """
+    import pickle
+
+    assert __environment_classes is not None
+    classes, lenses, lookups = __environment_classes
+    env = get_class_environment(classes[i], lenses=lenses, lookup=lookups.get(i))
+    packed = pack_class_environment(classes[i], env)
+    try:
+        pickle.dumps(packed)
+    except Exception:
+        return None
+    return packed
+
+
+def __class_environments_of(
+    classes: list[ClassDef],
+    lenses: bool,
+    lookups: "dict[ClassDef, ClassLookup] | None" = None,
+) -> list[ClassEnvironment]:
+    """
+    Returns the environments of `classes`, which are independent of each other,
+    with the lookups in `lookups`, if given. They are built in a pool of
+    `environment_jobs` forked workers, which inherit the analyzed tree, and
+    sent back packed.
+    """
+    import multiprocessing
+
+    global __environment_classes
+    lookup_of = (
+        {} if lookups is None else {i: lookups[c] for i, c in enumerate(classes)}
+    )
+    missing = [
+        i
+        for i, node in enumerate(classes)
+        if not lenses or node not in __class_environments
+    ]
+    if (
+        environment_jobs == 1
+        or len(missing) < 2
+        or "fork" not in multiprocessing.get_all_start_methods()
+    ):
+        return [
+            get_class_environment(node, lenses=lenses, lookup=lookup_of.get(i))
+            for i, node in enumerate(classes)
+        ]
+    __environment_classes = (classes, lenses, lookup_of)
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(processes=environment_jobs) as pool:
+            packed = dict(zip(missing, pool.map(__pack_environment_of, missing)))
+    finally:
+        __environment_classes = None
+    envs = []
+    for i, node in enumerate(classes):
+        if packed.get(i) is None:
+            envs.append(
+                get_class_environment(node, lenses=lenses, lookup=lookup_of.get(i))
+            )
+            continue
+        env = unpack_class_environment(node, packed[i])
+        if lenses:
+            __class_environments[node] = env
+        envs.append(env)
+    return envs
+
+
+def module_environment(
+    classes: list[ClassDef], envs: list[ClassEnvironment]
+) -> Environment:
+    """
+    Returns the environment of a module made of the environments `envs` of
+    its classes `classes`.
+    """
     env = Environment()
-    for node in mod_ast.body:
-        if isinstance(node, ClassDef):
-            g = graph(node)
-            cls_env = get_class_environment(node)
-            env.get_lenses[node.name] = cls_env.get_lenses
-            env.put_lenses[node.name] = cls_env.put_lenses
-            env.method_lenses[node.name] = cls_env.method_lenses
-            env.versions[node.name] = g
-            env.methods[node.name] = cls_env.methods
-            env.bases[node.name] = cls_env.bases
-            env.fields[node.name] = cls_env.fields
+    for node, cls_env in zip(classes, envs):
+        env.get_lenses[node.name] = cls_env.get_lenses
+        env.put_lenses[node.name] = cls_env.put_lenses
+        env.method_lenses[node.name] = cls_env.method_lenses
+        env.versions[node.name] = cls_env.versions
+        env.methods[node.name] = cls_env.methods
+        env.bases[node.name] = cls_env.bases
+        env.fields[node.name] = cls_env.fields
+        env.lens_names[node.name] = cls_env.lens_names
+        env.classes[node.name] = node
+    return env
+
+
+def get_module_environment(mod_ast: Module, *, lenses: bool = True) -> Environment:
+    """
+    Returns the environment of module `mod_ast`, shared in the same way as
+    class environments (see `get_class_environment`). Complete environments
+    use the lookups of the module (see `module_lookups`). Unless
+    `environment_jobs` is 1, the environments of its classes are built
+    concurrently.
+    """
+    from vpy.lib.lookup import module_lookups
+
+    if lenses and mod_ast in __module_environments:
+        return __module_environments[mod_ast]
+    classes = [node for node in mod_ast.body if isinstance(node, ClassDef)]
+    lookups = module_lookups(mod_ast) if lenses else None
+    env = module_environment(classes, __class_environments_of(classes, lenses, lookups))
+    if lenses:
+        __module_environments[mod_ast] = env
     return env
 
 
-def parse_module(module: str) -> tuple[Module, "NameCheckVisitor"]:
+def parse_module(
+    module: str,
+    *,
+    code: str | None = None,
+    tree: Module | None = None,
+    check_lenses: bool = True,
+    previous: Module | None = None,
+) -> tuple[Module, "NameCheckVisitor"]:
+    """
+    Imports and analyzes the module in file `module`. Its contents and AST can
+    be given if they are already at hand, in which case `tree` is annotated in
+    place instead of parsing the file again. If `check_lenses` is false, the
+    classes are annotated without checking their lenses, which looks up the
+    lenses between every pair of versions. If the analyzed tree of a previous
+    version of the module is given as `previous`, the lookups of its classes
+    are updated rather than made again (see `update_module_lookups`).
+    """
     from vpy.typechecker.pyanalyze.ast_annotator import annotate_file
 
     # src = inspect.getsource(module)
-    tree, visitor = annotate_file(module)
+    tree, visitor = annotate_file(
+        module, code=code, tree=tree, check_lenses=check_lenses, previous=previous
+    )
     return tree, visitor
 
 
@@ -218,65 +603,66 @@ def parse_class[T](module: ModuleType, cls: Type[T]) -> tuple[ClassDef, Graph]:
     return (cls_ast, g)
 
 
-@cache
+# Version decorators of each function, by decorator name, indexed the first
+# time any of them is queried (see `decorators_of`).
+__decorators: WeakKeyDictionary[ast.AST, dict[str, list[Call]]] = WeakKeyDictionary()
+
+
+def decorators_of(node: FunctionDef) -> dict[str, list[Call]]:
+    """
+    Returns the decorators of `node` called by name, indexed by that name.
+    They are indexed in a single scan of the decorator list, kept only as
+    long as `node`, so the decorators must not be changed after being
+    queried (transformers change their own copies).
+    """
+    if node not in __decorators:
+        decorators: dict[str, list[Call]] = {}
+        for d in node.decorator_list:
+            if isinstance(d, Call) and isinstance(d.func, Name):
+                decorators.setdefault(d.func.id, []).append(d)
+        __decorators[node] = decorators
+    return __decorators[node]
+
+
 def is_lens(node: FunctionDef) -> bool:
     """
     Check if the given `node` is a lens.
     """
-    return any(
-        isinstance(d, Call)
-        and isinstance(d.func, Name)
-        and (d.func.id in ["get", "put"])
-        for d in node.decorator_list
-    )
+    decorators = decorators_of(node)
+    return "get" in decorators or "put" in decorators
 
 
-@cache
 def get_at(node: FunctionDef) -> VersionId:
     """
     Returns the version id where method `node` is defined.
     """
+    decorators = decorators_of(node)
     version_decorators = [
-        d
-        for d in node.decorator_list
-        if isinstance(d, Call)
-        and isinstance(d.func, Name)
-        and d.func.id in ["get", "at", "put", "run"]
+        d for name in ["get", "at", "put", "run"] for d in decorators.get(name, [])
     ]
     if len(version_decorators) != 1:
         assert False
     return VersionId(version_decorators[0].args[0].value)
 
 
-@cache
 def get_to(lens: FunctionDef) -> VersionId:
     """
     Returns the version id to where `lens` is targetting.
     """
+    decorators = decorators_of(lens)
     version_decorators = [
-        d
-        for d in lens.decorator_list
-        if isinstance(d, Call)
-        and isinstance(d.func, Name)
-        and d.func.id in ["get", "put"]
+        d for name in ["get", "put"] for d in decorators.get(name, [])
     ]
     if len(version_decorators) != 1:
         assert False
     return VersionId(version_decorators[0].args[1].value)
 
 
-@cache
 def get_decorators(node: FunctionDef, dec_name: str) -> list[Call]:
-    return [
-        dec
-        for dec in node.decorator_list
-        if isinstance(dec, Call)
-        and isinstance(dec.func, Name)
-        and dec.func.id == dec_name
-    ]
+    return decorators_of(node).get(dec_name, [])
 
 
-@cache
+@lru_cache(maxsize=1024)
 def field_to_arg(field: Field) -> ast.arg:
     field_arg = ast.arg(arg=field.name)
     arg_t = annotation_from_type_value(field.type)
@@ -305,7 +691,7 @@ def annotation_from_type_value(val: Value) -> str:
 def create_init(g: Graph, cls_ast: ClassDef, v: VersionId) -> FunctionDef:
     from vpy.lib.lookup import fields_lookup
 
-    inherited_fields = fields_lookup(g, cls_ast, v)
+    inherited_fields = sorted(fields_lookup(g, cls_ast, v), key=lambda f: f.name)
     # Create function parameters
     self_param = ast.arg(arg="self", annotation=None)
     init_params = [field_to_arg(field) for field in inherited_fields]
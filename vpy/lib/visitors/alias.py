@@ -21,11 +21,39 @@ from vpy.lib.utils import (
     annotation_from_type_value,
     is_field,
     is_obj_attribute,
-    parse_class,
     typeof_node,
 )
 
 
+class Aliases(dict[expr, Attribute | None]):
+    """
+    Aliases found in a method, keyed by expression. Attribute and name keys
+    are also indexed by their source, so that the last aliased expression
+    with the same source as another one is found without scanning all keys.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__attributes: dict[str, Attribute] = {}
+        self.__names: dict[str, Name] = {}
+
+    def __setitem__(self, key: expr, value: Attribute | None):
+        if key not in self:
+            if isinstance(key, Attribute):
+                self.__attributes[ast.unparse(key)] = key
+            elif isinstance(key, Name):
+                self.__names[key.id] = key
+        super().__setitem__(key, value)
+
+    def last(self, node: Attribute | Name) -> expr | None:
+        """
+        Returns the last key with the same source as `node`, if any.
+        """
+        if isinstance(node, Name):
+            return self.__names.get(node.id)
+        return self.__attributes.get(ast.unparse(node))
+
+
 class AliasVisitor(ast.NodeVisitor):
     def __init__(
         self,
@@ -38,7 +66,7 @@ class AliasVisitor(ast.NodeVisitor):
         self.cls_ast = cls_ast
         self.env = env
         self.v_from = v_from
-        self.aliases: dict[expr, Attribute | None] = {}
+        self.aliases = Aliases()
 
     def visit_FunctionDef(self, node: FunctionDef) -> Any:
         for expr in node.body:
@@ -80,11 +108,6 @@ class AliasVisitor(ast.NodeVisitor):
             if isinstance(call_t, UnboundMethodValue) and isinstance(
                 call_t.composite.value.get_type(), type
             ):
-                cls = call_t.composite.value.get_type()
-                import sys
-
-                mod = sys.modules[cls.__module__]
-                cls_ast, g = parse_class(mod, cls)
                 # m[0]()
                 # a = self.change
                 # a()
@@ -107,7 +130,12 @@ class AliasVisitor(ast.NodeVisitor):
                         for m in self.env.methods[obj_type][self.v_from]
                         if m.name == mname
                     )
-                    visitor = AliasVisitor(g, cls_ast, self.env, self.v_from)
+                    visitor = AliasVisitor(
+                        self.env.versions[obj_type],
+                        self.env.classes[obj_type],
+                        self.env,
+                        self.v_from,
+                    )
                     rw_visitor = RewriteName(
                         src=Name(id=method.args.args[0].arg, ctx=Load()),
                         target=node.value.func.value,
@@ -149,13 +177,8 @@ class AliasVisitor(ast.NodeVisitor):
     def visit_Attribute(self, node: Attribute):
         # TODO: Revise this
         if isinstance(node.ctx, Load):
-            existing = [
-                n
-                for n in self.aliases.keys()
-                if isinstance(n, Attribute) and ast.unparse(node) == ast.unparse(n)
-            ]
-            if existing:
-                existing_node = existing[-1]
+            existing_node = self.aliases.last(node)
+            if existing_node is not None:
                 if self.aliases[existing_node] is not None:
                     self.aliases[node] = self.aliases[existing_node]
             else:
@@ -164,12 +187,7 @@ class AliasVisitor(ast.NodeVisitor):
 
     def visit_Name(self, node: Name) -> Any:
         if isinstance(node.ctx, Load):
-            existing = [
-                n
-                for n in self.aliases.keys()
-                if isinstance(n, Name) and n.id == node.id
-            ]
-            if existing:
-                existing_node = existing[-1]
+            existing_node = self.aliases.last(node)
+            if existing_node is not None:
                 if self.aliases[existing_node] is not None:
                     self.aliases[node] = self.aliases[existing_node]
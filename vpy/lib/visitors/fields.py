@@ -5,17 +5,13 @@ from ast import (
     AugAssign,
     ClassDef,
     Constant,
-    Del,
     FunctionDef,
-    Load,
     Name,
     NodeVisitor,
-    Store,
 )
-from typing import Type
 
-from vpy.lib.lib_types import Field, FieldReference, VersionId
-from vpy.lib.utils import get_at, typeof_node, is_field
+from vpy.lib.lib_types import Field, VersionId
+from vpy.lib.utils import get_at, typeof_node, is_obj_attribute
 from vpy.typechecker.pyanalyze.value import AnySource, AnyValue, TypedValue
 
 
@@ -92,47 +88,16 @@ class ClassFieldCollector(NodeVisitor):
             self.fields[field] = False
 
 
-class FieldNodeCollector(NodeVisitor):
+class ObjectAttributeCollector(NodeVisitor):
     """
-    Collect all field reference nodes in a class
+    Collect all attributes of objects in a node, which are the references to
+    the fields of any class, in the order in which they are visited.
     """
 
-    def __init__(self, fields: set[Field], *, ctx=(Load, Store, Del)):
-        self.fields = fields
-        self.references: set[FieldReference] = set()
-        self.ctx = ctx
-
-    def visit_Attribute(self, node):
-        if is_field(node, self.fields):
-            if type(node.ctx) in self.ctx:
-                self.references.add(
-                    FieldReference(
-                        field=Field(name=node.attr, type=typeof_node(node).simplify()),
-                        node=node,
-                        ref_node=node,
-                    )
-                )
-        self.visit(node.value)
-
-
-class FieldReferenceCollector(NodeVisitor):
-    """
-    Collect all field references in a node.
-    """
-
-    # TODO: Fix this. Should take env as argument, check type of attr obj and
-    # then check fields for that type.
-    def __init__(
-        self, fields: set[Field], cls: Type | None = None, *, ctx=(Load, Store, Del)
-    ):
-        self.fields = fields
-        self.references: set[Field] = set()
-        self.ctx = ctx
+    def __init__(self):
+        self.attributes: list[Attribute] = []
 
     def visit_Attribute(self, node: Attribute):
-        if is_field(node, self.fields):
-            if type(node.ctx) in self.ctx:
-                self.references.add(
-                    Field(name=node.attr, type=typeof_node(node).simplify())
-                )
+        if is_obj_attribute(node):
+            self.attributes.append(node)
         self.visit(node.value)
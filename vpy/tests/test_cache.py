@@ -0,0 +1,36 @@
+from vpy.lib import cache
+from vpy.lib.cache import imported_files, load_analysis, store_analysis
+
+
+def test_analysis_cache(tmp_path):
+    file = tmp_path / "mod.py"
+    file.write_text("class C: ...\n")
+    assert load_analysis(str(file)) == {}
+    store_analysis(str(file), {"versions": {"2", "1"}, "failures": []})
+    assert load_analysis(str(file)) == {"versions": ["1", "2"], "failures": []}
+    # Analyses of previous contents are dropped.
+    file.write_text("class D(C): ...\n")
+    assert load_analysis(str(file)) == {}
+    store_analysis(str(file), {"failures": []})
+    assert len(list((tmp_path / "__vpycache__").iterdir())) == 1
+
+
+def test_analysis_cache_imports(tmp_path):
+    base = tmp_path / "base.py"
+    base.write_text("class B: ...\n")
+    file = tmp_path / "mod.py"
+    file.write_text("from base import B\nimport os\n\nclass C(B): ...\n")
+    assert imported_files(str(file)) == (str(base),)
+    store_analysis(str(file), {"failures": []})
+    assert load_analysis(str(file)) == {"failures": []}
+    # Editing an imported module drops the analyses of its importers.
+    base.write_text("class B:\n    x = 1\n")
+    assert load_analysis(str(file)) == {}
+
+
+def test_analysis_cache_read_only(tmp_path, monkeypatch):
+    file = tmp_path / "mod.py"
+    file.write_text("class C: ...\n")
+    monkeypatch.setattr(cache, "writable", False)
+    store_analysis(str(file), {"failures": []})
+    assert not (tmp_path / "__vpycache__").exists()
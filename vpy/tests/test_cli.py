@@ -0,0 +1,63 @@
+import socket
+import threading
+
+from vpy import daemon
+from vpy.cli import ModuleFile, check_all, input_files
+
+
+def test_check_all_unparsable(tmp_path):
+    (tmp_path / "broken.py").write_text("class C(:\n")
+    (tmp_path / "plain.py").write_text("class C: ...\n")
+    mods = [ModuleFile(f) for f in input_files([str(tmp_path)])]
+    # The unparsable module fails the check without stopping the others.
+    assert check_all(mods, jobs=1) == 1
+    (tmp_path / "broken.py").unlink()
+    mods = [ModuleFile(f) for f in input_files([str(tmp_path)])]
+    assert check_all(mods, jobs=1) == 0
+
+
+def test_request_incomplete_reply(tmp_path):
+    path = str(tmp_path / "vpy.sock")
+    assert daemon.request(path, ["-l"]) is None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+
+        def reply():
+            conn, _ = server.accept()
+            with conn:
+                conn.recv(4096)
+                conn.sendall(b'{"stdout": "')
+
+        thread = threading.Thread(target=reply)
+        thread.start()
+        # A daemon that dies while replying is treated as no daemon.
+        assert daemon.request(path, ["-l"]) is None
+        thread.join()
+
+
+def test_daemon_warm_modules(tmp_path, monkeypatch):
+    from vpy import cli
+
+    file = tmp_path / "mod.py"
+    file.write_text(
+        "from vpy.decorators import at, version\n"
+        "\n"
+        '@version(name="1")\n'
+        '@version(name="2", upgrades=["1"])\n'
+        "class C:\n"
+        '    @at("1")\n'
+        "    def m(self) -> int:\n"
+        "        return 1\n"
+    )
+    monkeypatch.setattr(cli, "warm_modules", {})
+    first = daemon.run(["-i", str(file), "-t", "2"], str(tmp_path))
+    assert first["status"] == 0 and "def m" in first["stdout"]
+    mod = cli.module_file(str(file))
+    # Unchanged modules keep their analysis between requests.
+    assert daemon.run(["-i", str(file), "-t", "2"], str(tmp_path)) == first
+    assert cli.module_file(str(file)) is mod
+    file.write_text(file.read_text().replace("def m(", "def renamed("))
+    second = daemon.run(["-i", str(file), "-t", "2"], str(tmp_path))
+    assert "def renamed" in second["stdout"] and "def m(" not in second["stdout"]
+    assert cli.module_file(str(file)) is not mod
@@ -0,0 +1,124 @@
+import ast
+import os
+
+from vpy.lib import utils
+from vpy.lib.utils import get_module_environment, pack_class_environment, parse_module
+
+EXAMPLE = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "..",
+    "examples",
+    "refactor",
+    "method_parameters.py",
+)
+
+
+def packed_environments(jobs):
+    utils.environment_jobs = jobs
+    try:
+        tree, _ = parse_module(EXAMPLE)
+        env = get_module_environment(tree)
+    finally:
+        utils.environment_jobs = 1
+    return {
+        node.name: pack_class_environment(node, utils.get_class_environment(node))
+        for node in tree.body
+        if isinstance(node, ast.ClassDef)
+    }, env
+
+
+def test_parallel_environment():
+    serial, serial_env = packed_environments(1)
+    parallel, parallel_env = packed_environments(2)
+    assert len(parallel) > 1
+    assert parallel == serial
+    assert parallel_env.versions.keys() == serial_env.versions.keys()
+
+
+UNPICKLABLE = """
+from vpy.decorators import at, version
+
+
+@version(name="1")
+class A:
+    @at("1")
+    def __init__(self):
+        self.a = lambda: 1
+
+
+@version(name="1")
+class B:
+    @at("1")
+    def __init__(self):
+        self.b = 1
+"""
+
+
+def test_parallel_environment_unpicklable(tmp_path):
+    path = tmp_path / "unpicklable.py"
+    path.write_text(UNPICKLABLE)
+    utils.environment_jobs = 2
+    try:
+        tree, _ = parse_module(str(path))
+        env = get_module_environment(tree)
+    finally:
+        utils.environment_jobs = 1
+    assert {field.name for field in env.fields["A"]["1"]} == {"a"}
+    assert {field.name for field in env.fields["B"]["1"]} == {"b"}
+
+
+LENSES = """
+from vpy.decorators import at, get, version
+
+
+@version(name="1")
+@version(name="2", replaces=["1"])
+@version(name="3", replaces=["2"])
+class A:
+    @at("1")
+    def __init__(self):
+        self.a = 0
+
+    @at("2")
+    def __init__(self):
+        self.b = 0
+
+    @at("3")
+    def __init__(self):
+        self.c = 0
+
+    @get("1", "2", "b")
+    def lens_b(self):
+        return self.a
+
+    @get("2", "3", "c")
+    def lens_c(self):
+        return self.b
+"""
+
+
+def test_updated_environment(tmp_path):
+    old_path = tmp_path / "updated_old.py"
+    old_path.write_text(LENSES)
+    old, _ = parse_module(str(old_path))
+    get_module_environment(old)
+    edits = [
+        LENSES.replace("self.a = 0", "self.a = 1"),
+        LENSES.replace("self.a = 0", "self.z = 0"),
+        LENSES.replace("return self.a", "return self.a + 1"),
+        LENSES.replace("return self.b", "return self.c"),
+    ]
+    for k, edit in enumerate(edits):
+        envs = []
+        for name, previous in (("updated", old), ("fresh", None)):
+            path = tmp_path / f"{name}_{k}.py"
+            path.write_text(edit)
+            tree, _ = parse_module(str(path), previous=previous)
+            get_module_environment(tree)
+            envs.append(
+                pack_class_environment(
+                    tree.body[1], utils.get_class_environment(tree.body[1])
+                )
+            )
+        assert envs[0] == envs[1]
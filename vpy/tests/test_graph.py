@@ -0,0 +1,82 @@
+import ast
+from vpy.lib.lib_types import VersionId, graph_cache_clear, graph_cache_info
+from vpy.lib.utils import graph
+
+SOURCE = """
+@version(name="1")
+@version(name="2", replaces=["1"])
+@version(name="3", upgrades=["1"])
+@version(name="4", replaces=["2", "3"])
+class C: ...
+"""
+
+
+def names(versions):
+    return {v.name for v in versions}
+
+
+def test_graph_index():
+    cls_ast = ast.parse(SOURCE).body[0]
+    assert isinstance(cls_ast, ast.ClassDef)
+    g = graph(cls_ast)
+    assert g.find_version(VersionId("2")).name == "2"
+    assert g.find_version(VersionId("5")) is None
+    assert names(g.parents(VersionId("4"))) == {"2", "3"}
+    assert names(g.replacements(VersionId("1"))) == {"2"}
+    assert names(g.branches(VersionId("1"))) == {"3"}
+    assert g.ancestors(VersionId("4")) == {"1", "2", "3"}
+    assert g.descendants(VersionId("1")) == {"2", "3", "4"}
+    assert g.is_ancestor(VersionId("1"), VersionId("4"))
+    assert not g.is_ancestor(VersionId("2"), VersionId("3"))
+
+
+def test_graph_view():
+    cls_ast = ast.parse(SOURCE).body[0]
+    assert isinstance(cls_ast, ast.ClassDef)
+    g = graph(cls_ast)
+    view = g.delete(VersionId("2"))
+    assert view.find_version(VersionId("2")) is None
+    assert names(view.parents(VersionId("4"))) == {"3"}
+    assert view.replacements(VersionId("2")) == set()
+    assert [v.name for v in view.topological_order()][0] == "1"
+    # The underlying graph is left untouched.
+    assert names(g.parents(VersionId("4"))) == {"2", "3"}
+
+
+def test_graph_cycle():
+    cls_ast = ast.parse("""
+@version(name="1", upgrades=["2"])
+@version(name="2", replaces=["1"])
+class C: ...
+""").body[0]
+    assert isinstance(cls_ast, ast.ClassDef)
+    cycle = graph(cls_ast).find_cycle()
+    assert cycle is not None
+    assert [(u.name, v.name) for u, v in cycle] == [("1", "2"), ("2", "1")]
+    assert graph(ast.parse(SOURCE).body[0]).find_cycle() is None
+
+
+def test_graph_cache():
+    graph_cache_clear()
+    g = graph(ast.parse(SOURCE).body[0])
+    # A class parsed again, or edited without touching its versions, shares
+    # the graph of the first one.
+    edited = SOURCE.replace("class C: ...", "class C:\n    x: int")
+    assert graph(ast.parse(edited).body[0]) is g
+    assert graph(ast.parse(SOURCE.replace('"4"', '"5"')).body[0]) is not g
+    info = graph_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+
+
+def test_graph_without_literal_name():
+    cls_ast = ast.parse("""
+NAME = "1"
+
+@version(name=NAME)
+@version(name="2")
+class C: ...
+""").body[1]
+    assert isinstance(cls_ast, ast.ClassDef)
+    g = graph(cls_ast)
+    assert g.find_version(VersionId("2")).name == "2"
+    assert [v.name for v in g.all()] == ["2"]
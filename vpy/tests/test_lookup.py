@@ -0,0 +1,118 @@
+import ast
+from vpy.lib.lib_types import VersionId
+from vpy.lib.lookup import decorator_index
+from vpy.lib.utils import get_at, get_to, is_lens
+
+SOURCE = """
+@version(name="1")
+@version(name="2", replaces=["1"])
+class C:
+    @at("1")
+    def m(self): ...
+
+    @at("2")
+    def n(self): ...
+
+    @get("2", "1", "x")
+    def lens_x(self): ...
+"""
+
+
+def test_decorator_index():
+    cls_ast = ast.parse(SOURCE).body[0]
+    assert isinstance(cls_ast, ast.ClassDef)
+    m, n, lens = cls_ast.body
+    index = decorator_index(cls_ast)
+    assert index.methods == [m, n]
+    assert index.methods_at(VersionId("1")) == {m}
+    assert index.edges == {("2", "1", "x"): lens}
+    assert index.into(VersionId("1")) == {"x": {"2": lens}}
+    assert is_lens(lens) and not is_lens(m)
+    assert (get_at(lens), get_to(lens)) == ("2", "1")
+    assert decorator_index(cls_ast) is index
+    # The index is rebuilt when the body of the class changes.
+    cls_ast.body.remove(m)
+    assert decorator_index(cls_ast).methods == [n]
+
+
+def test_object_attributes_after_annotation(tmp_path):
+    from vpy.lib.utils import object_attributes, parse_module
+
+    src = """
+from vpy.decorators import at, version
+
+@version(name="1")
+class C:
+    @at("1")
+    def __init__(self):
+        self.x = 1
+
+    @at("1")
+    def m(self):
+        return self.x
+"""
+    path = tmp_path / "c.py"
+    path.write_text(src)
+    tree = ast.parse(src)
+    m = tree.body[1].body[1]
+    # Before annotation, the type of `self` is unknown.
+    assert object_attributes(m) == []
+    parse_module(str(path), code=src, tree=tree, check_lenses=False)
+    assert [attr.attr for attr in object_attributes(m)] == ["x"]
+
+
+def test_shortest_lens_path(tmp_path):
+    from vpy.lib.lookup import ClassLookup
+    from vpy.lib.utils import graph, parse_module
+
+    src = """
+from vpy.decorators import at, get, version
+
+@version(name="1")
+@version(name="2", replaces=["1"])
+@version(name="3", replaces=["2"])
+@version(name="4", replaces=["3"])
+class C:
+    @at("1")
+    def __init__(self):
+        self.x = 1
+
+    @at("2")
+    def __init__(self):
+        self.y = 1
+
+    @at("3")
+    def __init__(self):
+        self.z = 1
+
+    @at("4")
+    def __init__(self):
+        self.w = 1
+
+    @get("1", "2", "y")
+    def y_from_1(self):
+        return self.x
+
+    @get("2", "3", "z")
+    def z_from_2(self):
+        return self.y
+
+    @get("3", "4", "w")
+    def w_from_3(self):
+        return self.z
+
+    @get("2", "4", "w")
+    def w_from_2(self):
+        return self.y
+"""
+    path = tmp_path / "c.py"
+    path.write_text(src)
+    tree, _ = parse_module(str(path), check_lenses=False)
+    cls_ast = tree.body[1]
+    lenses = ClassLookup(cls_ast).field_lenses_from(graph(cls_ast), VersionId("1"))
+    assert lenses.data == {}
+    # Field w of version 4 is read through version 2, in two steps, rather
+    # than through versions 2 and 3.
+    assert lenses["4"]["w"].node.name == "w_from_2"
+    assert lenses["3"]["z"].node.name == "z_from_2"
+    assert set(lenses.data) == {"3", "4"}
@@ -0,0 +1,35 @@
+import sys
+from vpy.decorators import at, run, version
+from vpy.lib.lib_types import VersionId
+from vpy.lib.runtime import runtime_slice
+
+
+@version(name="1")
+@version(name="2", replaces=["1"])
+class Counter:
+    @at("1")
+    def __init__(self):
+        self.value = 0
+
+    @at("1")
+    def inc(self) -> int:
+        return 1
+
+    @at("2")
+    def inc(self) -> int:
+        return 2
+
+
+@run("2")
+def entry() -> int:
+    return Counter().inc()
+
+
+def test_run_reuses_slice():
+    module = sys.modules[__name__]
+    assert entry() == 2
+    sl = runtime_slice(module, VersionId("2"))
+    assert entry() == 2
+    assert runtime_slice(module, VersionId("2")) is sl
+    # Classes of the module are restored after each run.
+    assert Counter().inc() == 1
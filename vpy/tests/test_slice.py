@@ -0,0 +1,97 @@
+import ast
+import os
+import subprocess
+import sys
+
+from vpy.lib.slice import SliceSession
+from vpy.lib.transformers.module import ModuleTransformer
+from vpy.lib.utils import (
+    deepcopy_node,
+    fresh_var,
+    get_class_environment,
+    lazy_class_environment,
+    parse_module,
+    typeof_node,
+)
+
+EXAMPLE = os.path.join(
+    os.path.dirname(__file__), "..", "..", "examples", "refactor", "fields.py"
+)
+
+
+def test_slice_session():
+    session = SliceSession(EXAMPLE)
+    analyzed = ast.dump(session.tree)
+    first = {v: session.code(v) for v in sorted(session.versions())}
+    # Slicing leaves the analyzed module untouched, so it can be sliced again.
+    assert ast.dump(session.tree) == analyzed
+    second = {v: session.code(v) for v in reversed(sorted(first))}
+    assert first == second
+    assert session.code("1", strict=True) != session.code("1")
+
+
+def test_inferred_types():
+    session = SliceSession(EXAMPLE)
+    cls_ast = session.tree.body[-1]
+    nodes = list(ast.walk(cls_ast))
+    # The types are kept in a side table instead of on the nodes.
+    assert not any(hasattr(node, "inferred_value") for node in nodes)
+    copies = list(ast.walk(deepcopy_node(cls_ast)))
+    assert [typeof_node(node) for node in copies] == [
+        typeof_node(node) for node in nodes
+    ]
+
+
+def test_fresh_var():
+    names = {"self", "_0", "_2"}
+    assert [fresh_var(names), fresh_var(names)] == ["_1", "_3"]
+
+
+def test_lazy_environment():
+    session = SliceSession(EXAMPLE)
+    cls_ast = session.tree.body[-1]
+    assert isinstance(cls_ast, ast.ClassDef)
+    env = lazy_class_environment(cls_ast)
+    lens = env.get_lenses.find_lens(v_from="1", v_to="2", attr="y")
+    assert lens is not None and lens.node is not None
+    # Only the lenses out of version 1 were looked up.
+    assert set(env.get_lenses.data) == {"1"}
+    assert env.lens_names == {"lens_x", "lens_y"}
+    eager = get_class_environment(cls_ast)
+    assert {v: t for v, t in env.get_lenses.items() if t} == {
+        v: t for v, t in eager.get_lenses.items() if t
+    }
+    assert env.methods["2"] == eager.methods["2"]
+
+
+def sliced_with_seed(seed: str) -> str:
+    name = os.path.join(os.path.dirname(EXAMPLE), "..", "name.py")
+    script = "import sys\nfrom vpy.lib.slice import SliceSession\n"
+    script += "session = SliceSession(sys.argv[1])\n"
+    script += "print(*(session.code(v) for v in sorted(session.versions())))"
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=root)
+    return subprocess.run(
+        [sys.executable, "-c", script, name],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def test_slice_deterministic():
+    # Fields are emitted in the same order whatever the hash seed.
+    assert len({sliced_with_seed(seed) for seed in "1234"}) == 1
+
+
+def test_transform_without_environment():
+    name = os.path.join(os.path.dirname(EXAMPLE), "..", "name.py")
+    tree, _ = parse_module(name)
+    analyzed = ast.dump(tree)
+    session = SliceSession(name)
+    # Each version is sliced from the same tree, which is left untouched.
+    for v in ["full", "init", "full"]:
+        sliced = ModuleTransformer(v).visit(tree)
+        assert ast.unparse(ast.fix_missing_locations(sliced)) == session.code(v)
+        assert ast.dump(tree) == analyzed
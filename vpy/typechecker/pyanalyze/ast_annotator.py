@@ -3,8 +3,8 @@
 Functionality for annotating the AST of a module.
 
 The APIs in this module use pyanalyze's type inference to annotate
-an AST with inferred :class:`pyanalyze.value.Value` objects in `.inferred_value`
-attributes.
+an AST with inferred :class:`pyanalyze.value.Value` objects, which are read
+with :func:`vpy.lib.utils.typeof_node`.
 
 """
 
@@ -36,12 +36,12 @@ def annotate_code(
     show_errors: bool = False,
     verbose: bool = False,
 ) -> tuple[ast.Module, NameCheckVisitor]:
-    """Annotate a piece of Python code. Return an AST with extra `inferred_value` attributes.
+    """Annotate a piece of Python code. Return an AST whose inferred values are read with `typeof_node`.
 
     Example usage::
 
         tree = annotate_code("a = 1")
-        print(tree.body[0].targets[0].inferred_value)  # Literal[1]
+        print(typeof_node(tree.body[0].targets[0]))  # Literal[1]
 
     This will import and ``exec()`` the provided code. If this fails, the code will
     still be annotated but the quality of the annotations will be much lower.
@@ -84,14 +84,18 @@ def annotate_file(
     verbose: bool = False,
     dump: bool = False,
     show_errors: bool = True,
+    code: Optional[str] = None,
+    tree: Optional[ast.Module] = None,
+    check_lenses: bool = True,
+    previous: Optional[ast.Module] = None,
 ) -> tuple[ast.Module, NameCheckVisitor]:
-    """Annotate the code in a Python source file. Return an AST with extra `inferred_value`
-    attributes.
+    """Annotate the code in a Python source file. Return an AST whose inferred values are
+    read with `typeof_node`.
 
     Example usage::
 
         tree = annotate_file("/some/file.py")
-        print(tree.body[0].targets[0].inferred_value)  # Literal[1]
+        print(typeof_node(tree.body[0].targets[0]))  # Literal[1]
 
     This will import and exec() the provided code. If this fails, the code will
     still be annotated but the quality of the annotations will be much lower.
@@ -109,6 +113,20 @@ def annotate_file(
     :param verbose: If True, more details are printed.
     :type verbose: bool
 
+    :param code: Contents of the file, if they were already read.
+    :type code: Optional[str]
+
+    :param tree: AST of `code`, if it was already parsed. It is annotated in place.
+    :type tree: Optional[ast.Module]
+
+    :param check_lenses: If False, the versions of the classes are not checked
+                         against their lenses, which is only needed for errors.
+    :type check_lenses: bool
+
+    :param previous: Annotated AST of a previous version of the module, whose class
+                     lookups are updated for `tree` instead of being made again.
+    :type previous: Optional[ast.Module]
+
     """
     filename = os.fspath(path)
     try:
@@ -118,11 +136,20 @@ def annotate_file(
             traceback.print_exc()
         mod = None
 
-    with open(filename, encoding="utf-8") as f:
-        code = f.read()
-    tree = ast.parse(code)
+    if code is None:
+        with open(filename, encoding="utf-8") as f:
+            code = f.read()
+    if tree is None:
+        tree = ast.parse(code)
     visitor = _annotate_module(
-        filename, mod, tree, code, visitor_cls, show_errors=show_errors
+        filename,
+        mod,
+        tree,
+        code,
+        visitor_cls,
+        show_errors=show_errors,
+        check_lenses=check_lenses,
+        previous=previous,
     )
     if dump:
         dump_annotated_code(tree)
@@ -133,6 +160,8 @@ def dump_annotated_code(
     node: ast.AST, depth: int = 0, field_name: Optional[str] = None
 ) -> None:
     """Print an annotated AST in a readable format."""
+    from vpy.lib.utils import typeof_node
+
     line = type(node).__name__
     if field_name is not None:
         line = f"{field_name}: {line}"
@@ -145,8 +174,7 @@ def dump_annotated_code(
         line = f"{line}(@{node.lineno}:{node.col_offset})"
     print(" " * depth + line)
     new_depth = depth + 2
-    if hasattr(node, "inferred_value"):
-        print(" " * new_depth + str(node.inferred_value))
+    print(" " * new_depth + str(typeof_node(node)))
     for field_name, value in ast.iter_fields(node):
         if isinstance(value, ast.AST):
             dump_annotated_code(value, new_depth, field_name)
@@ -170,6 +198,8 @@ def _annotate_module(
     code_str: str,
     visitor_cls: Type[NameCheckVisitor],
     show_errors: bool = True,
+    check_lenses: bool = True,
+    previous: Optional[ast.Module] = None,
 ) -> NameCheckVisitor:
     """Annotate the AST for a module with inferred values.
 
@@ -185,5 +215,7 @@ def _annotate_module(
         | {error_code: show_errors for error_code in ErrorCode},
         **kwargs,
     )
+    version_visitor.check_lenses = check_lenses
+    version_visitor.previous_tree = previous
     version_visitor.check()
     return version_visitor
@@ -661,6 +661,7 @@ class ClassAttributeChecker:
         ts_finder: Optional[TypeshedFinder] = None,
     ) -> None:
         self.tree = None
+        self.env: "Environment | None" = None
         self.options = options
         # we might not have examined all parent classes when looking for attributes set
         # we dump them here. incase the callers want to extend coverage.
@@ -706,10 +707,9 @@ class ClassAttributeChecker:
         if exc_type is None and self.enabled:
             from vpy.lib.utils import get_module_environment
 
-            if self.tree:
-                env = get_module_environment(self.tree)
-            else:
-                env = None
+            env = self.env
+            if env is None and self.tree:
+                env = get_module_environment(self.tree, lenses=False)
             self.check_attribute_reads(env)
 
             if self.should_check_unused_attributes:
@@ -1775,12 +1775,14 @@ class NameCheckVisitor(node_visitor.ReplacingNodeVisitor):
         self, version: VersionId | None, varname: str, node: ast.AST
     ) -> None:
         if isinstance(node, ast.FunctionDef):
-            from vpy.lib.lookup import _method_lookup, get_at, MethodConflictException
+            from vpy.lib.lookup import class_lookup, get_at, MethodConflictException
 
             cls_ast: ast.ClassDef = self.node_context.nearest_enclosing(ast.ClassDef)
+            # Method lookups do not depend on inferred types, so they are shared
+            # with the lookups of the module (and kept across its edits).
             try:
-                m = _method_lookup(
-                    self.env.versions[cls_ast.name], cls_ast, varname, version
+                m = class_lookup(cls_ast, self.tree).method_lookup(
+                    self.env.versions[cls_ast.name], varname, version
                 )
             except MethodConflictException as e:
                 self.show_error(
@@ -819,7 +819,7 @@ class BaseNodeVisitor(ast.NodeVisitor):
         return failures, None
 
     @classmethod
-    def merge_extra_data(cls, extra_data: object, **kwargs: Any) -> None:
+    def merge_extra_data(cls, extra_data: object, **kwargs: Any) -> Any:
         """Override this to aggregate data passed from parallel workers."""
         pass
 
@@ -1,12 +1,16 @@
+import concurrent.futures
+import io
 from ast import ClassDef, Constant, FunctionDef, List, Load, Module, Store
-from typing import TYPE_CHECKING
+from contextlib import redirect_stderr
+from functools import cache
+from typing import TYPE_CHECKING, Any, Iterable
 
-from networkx import NetworkXNoCycle, find_cycle
 from vpy.typechecker.pyanalyze.node_visitor import (
     BaseNodeVisitor,
     Failure,
 )
 from vpy.typechecker.pyanalyze.value import CallableValue, CanAssignError
+from .checker import Checker
 from .name_check_visitor import ClassAttributeChecker, NameCheckVisitor
 from .error_code import ErrorCode
 
@@ -14,6 +18,17 @@ if TYPE_CHECKING:
     from vpy.lib.lib_types import VersionId, ClassEnvironment, Graph
 
 
+@cache
+def shared_checker() -> Checker:
+    """
+    Returns the checker shared by the modules analyzed in this process, as
+    pyanalyze shares one between the files it checks, so that its argument
+    specs and typeshed lookups are reused by long-running processes such as
+    the daemon (see `vpy.daemon`).
+    """
+    return NameCheckVisitor.prepare_constructor_kwargs({})["checker"]
+
+
 class VersionCheckVisitor(BaseNodeVisitor):
     def visit_Module(self, node: Module):
         versions: set[Graph] = set()
@@ -93,19 +108,16 @@ class VersionCheckVisitor(BaseNodeVisitor):
                                     )
                                     return
 
-        try:
-            from vpy.lib.utils import graph
+        from vpy.lib.utils import graph
 
-            g = graph(node)
-            cycle = find_cycle(g)
+        cycle = graph(node).find_cycle()
+        if cycle is not None:
             self.show_error(
                 node,
                 f"Cycle detected in version graph: {cycle}",
                 ErrorCode.cyclic_version_graph,
             )
             return
-        except NetworkXNoCycle:
-            pass
         self.graph = versions
         for fn in (n for n in node.body if isinstance(n, FunctionDef)):
             self.visit(fn)
@@ -140,9 +152,56 @@ class VersionCheckVisitor(BaseNodeVisitor):
 
 class LensCheckVisitor(BaseNodeVisitor):
     error_code_enum = ErrorCode
+    # Whether the classes are checked against their lenses once annotated.
+    check_lenses = True
+    # Analyzed tree of a previous version of the module, if any.
+    previous_tree: Module | None = None
+
+    @classmethod
+    def check_modules(
+        cls, files: Iterable[str], *, jobs: int | None = None
+    ) -> dict[str, list[Failure]]:
+        """
+        Checks every module in `files`, in a pool of `jobs` worker processes
+        unless `jobs` is 1, and returns the failures of each module by file
+        name, as merged by `merge_extra_data`.
+        """
+        args: list[tuple[str, dict[str, Any]]] = [
+            (filename, {}) for filename in sorted(files)
+        ]
+        if jobs != 1:
+            with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+                results = list(executor.map(cls._check_file_single_arg, args))
+        else:
+            results = [cls._check_file_single_arg(arg) for arg in args]
+        return cls.merge_extra_data([extra for _, extra in results])
+
+    @classmethod
+    def check_file_in_worker(
+        cls, filename: str, **kwargs: Any
+    ) -> tuple[list[Failure], Any]:
+        """
+        Imports and checks module `filename` without printing its failures,
+        which include those found by its attribute checker.
+        """
+        from vpy.lib.utils import parse_module
+
+        with redirect_stderr(io.StringIO()):
+            _, visitor = parse_module(filename)
+        return visitor.all_failures, (filename, visitor.all_failures)
+
+    @classmethod
+    def merge_extra_data(
+        cls, extra_data: Any, **kwargs: Any
+    ) -> dict[str, list[Failure]]:
+        """
+        Returns the failures of each checked module, keyed by file name.
+        """
+        return {filename: failures for filename, failures in extra_data}
 
     def check(self) -> list[Failure]:
-        from vpy.lib.utils import get_module_environment
+        from vpy.lib.lookup import update_module_lookups
+        from vpy.lib.utils import get_module_environment, store_inferred_types
 
         version_check_visitor = VersionCheckVisitor(
             filename=self.filename,
@@ -154,8 +213,12 @@ class LensCheckVisitor(BaseNodeVisitor):
         if version_check_visitor.all_failures:
             self.all_failures = version_check_visitor.all_failures
             return version_check_visitor.all_failures
-        kwargs = NameCheckVisitor.prepare_constructor_kwargs({})
+        kwargs = NameCheckVisitor.prepare_constructor_kwargs(
+            {"checker": shared_checker()}
+        )
         options = kwargs["checker"].options
+        if self.previous_tree is not None:
+            update_module_lookups(self.tree, self.previous_tree)
         with ClassAttributeChecker(enabled=True, options=options) as attribute_checker:
             self.name_check_visitor = NameCheckVisitor(
                 filename=self.filename,
@@ -166,14 +229,21 @@ class LensCheckVisitor(BaseNodeVisitor):
                 attribute_checker=attribute_checker,
                 **kwargs,
             )
-            # name_check_visitor.env = get_module_environment(self.tree)
-            self.name_check_visitor.env = get_module_environment(self.tree)
+            # Types are not inferred yet, so the name checker only gets the
+            # versions, methods and bases of each class.
+            self.name_check_visitor.env = get_module_environment(
+                self.tree, lenses=False
+            )
             self.name_check_visitor.check()
+            store_inferred_types(self.tree)
+            if self.check_lenses:
+                self.env = get_module_environment(self.tree)
+                attribute_checker.env = self.env
         if self.name_check_visitor.all_failures:
             self.all_failures = self.name_check_visitor.all_failures
             # return self.name_check_visitor.all_failures
-        self.env = get_module_environment(self.tree)
-        self.visit(self.tree)
+        if self.check_lenses:
+            self.visit(self.tree)
         attribute_checker.tree = self.tree
         return self.all_failures
 
@@ -251,13 +321,11 @@ class LensCheckVisitor(BaseNodeVisitor):
         cls_env: "ClassEnvironment",
     ):
         from vpy.lib.lookup import get_at
-        from vpy.lib.visitors.fields import FieldNodeCollector
+        from vpy.lib.utils import field_references
 
         mver = get_at(m)
         if mver != v and mver not in cls_env.bases[v]:
-            ref_visitor = FieldNodeCollector(fields=cls_env.fields[mver])
-            ref_visitor.visit(m)
-            for ref in ref_visitor.references:
+            for ref in field_references(m, cls_env.fields[mver]):
                 # Check if a get lens for this attribute exists
                 if isinstance(ref.ref_node.ctx, Load):
                     if (
@@ -276,23 +344,17 @@ class LensCheckVisitor(BaseNodeVisitor):
                     for lens in (
                         cls_env.get_lenses.get(mver, dict()).get(v, dict()).values()
                     ):
-                        lens_ref_visitor = FieldNodeCollector(
-                            fields=cls_env.fields[mver]
-                        )
                         if lens.node is None:
                             continue
-                        lens_ref_visitor.visit(lens.node)
-                        if any(
-                            r.field.name == ref.field.name
-                            for r in lens_ref_visitor.references
-                        ):
+                        lens_refs = field_references(lens.node, cls_env.fields[mver])
+                        if any(r.field.name == ref.field.name for r in lens_refs):
                             found = True
                             # If there are multiple attributes referenced in the lens, we need a get lens for each of
                             # those
-                            if len(lens_ref_visitor.references) > 1:
+                            if len(lens_refs) > 1:
                                 other_refs = [
                                     r
-                                    for r in lens_ref_visitor.references
+                                    for r in lens_refs
                                     if r.field.name != ref.field.name
                                 ]
                                 for other_ref in other_refs:
@@ -321,15 +383,16 @@ class LensCheckVisitor(BaseNodeVisitor):
     ):
         from vpy.lib.lib_types import VersionedMethod
         from vpy.lib.lookup import (
+            class_lookup,
             get_at,
             is_lens,
-            methods_lookup,
             MethodConflictException,
         )
 
+        lookup = class_lookup(cls_ast, self.tree)
         for v in g.all():
             try:
-                methods = methods_lookup(g, cls_ast, v.name, _except=True)
+                methods = lookup.methods_lookup(g, v.name, _except=True)
             except MethodConflictException as e:
                 for d in e.definitions:
                     self.show_error(